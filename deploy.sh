@@ -94,7 +94,7 @@ function package_lambda_functions() {
     
     # Install dependencies to each Lambda directory
     echo_status "Installing dependencies for Lambda functions..."
-    pip3 install boto3 crewai python-dotenv -t lambda/common/
+    pip3 install boto3 crewai python-dotenv orjson Pillow -t lambda/common/
     
     # Package each Lambda function
     echo_status "Creating Lambda packages..."
@@ -139,6 +139,16 @@ function package_lambda_functions() {
     zip -r ../dist/orchestrator.zip .
     cd ../..
     
+    # Add the common package, imported as common.*, to each Lambda package
+    echo_status "Adding the common package to Lambda packages..."
+    cd lambda
+    zip dist/receipt_interpreter.zip common/*.py
+    zip dist/expiration_date_estimator.zip common/*.py
+    zip dist/grocery_tracker.zip common/*.py
+    zip dist/recipe_recommender.zip common/*.py
+    zip dist/orchestrator.zip common/*.py
+    cd ..
+    
     echo_status "Lambda functions packaged successfully."
 }
 
@@ -0,0 +1,76 @@
+import os
+import time
+import uuid
+from botocore.exceptions import ClientError
+from common.aws import S3, SM_RUNTIME
+
+# Polling settings for asynchronous inference results
+ASYNC_POLL_INITIAL_DELAY = 0.5
+ASYNC_POLL_MAX_DELAY = 8
+
+# Seconds to wait for a result. Set per function with DEEPSEEK_ASYNC_TIMEOUT to
+# fit its own timeout; the default fits API Gateway's 29 second limit.
+ASYNC_POLL_TIMEOUT = int(os.environ.get('DEEPSEEK_ASYNC_TIMEOUT', '25'))
+
+def invoke_endpoint_async(endpoint_name, body, input_bucket, timeout=ASYNC_POLL_TIMEOUT):
+    """
+    Invoke an asynchronous SageMaker endpoint and wait for its output.
+    
+    The request body is staged in S3, the endpoint is invoked with
+    InvokeEndpointAsync, and the returned OutputLocation is polled with
+    exponential backoff until the result (or a failure) is written.
+    
+    Args:
+        endpoint_name (str): The name of the SageMaker endpoint
+        body (str or bytes): The JSON request body
+        input_bucket (str): S3 bucket the request body is staged in
+        timeout (int, optional): Seconds to wait for the result. Defaults to DEEPSEEK_ASYNC_TIMEOUT.
+        
+    Returns:
+        bytes: The raw response body written by the endpoint
+    """
+    input_key = f"deepseek-async-input/{uuid.uuid4()}.json"
+    S3.put_object(
+        Bucket=input_bucket,
+        Key=input_key,
+        Body=body,
+        ContentType='application/json'
+    )
+    
+    response = SM_RUNTIME.invoke_endpoint_async(
+        EndpointName=endpoint_name,
+        ContentType='application/json',
+        InputLocation=f"s3://{input_bucket}/{input_key}"
+    )
+    
+    output_location = response['OutputLocation']
+    failure_location = response.get('FailureLocation')
+    
+    delay = ASYNC_POLL_INITIAL_DELAY
+    deadline = time.monotonic() + timeout
+    while True:
+        output = read_s3_object(output_location)
+        if output is not None:
+            return output
+        
+        if failure_location and read_s3_object(failure_location) is not None:
+            raise Exception(f"DeepSeek asynchronous inference failed, see {failure_location}")
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise Exception(f"Timed out waiting for DeepSeek asynchronous inference output at {output_location}")
+        
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, ASYNC_POLL_MAX_DELAY)
+
+def read_s3_object(s3_uri):
+    """
+    Return the contents of the object at an s3://bucket/key URI, or None if it does not exist yet.
+    """
+    bucket, _, key = s3_uri[len('s3://'):].partition('/')
+    try:
+        return S3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
@@ -0,0 +1,23 @@
+import boto3
+from botocore.config import Config
+
+# One session and pooled, keep-alive clients shared by every module in the
+# Lambda container, so credentials are resolved once and warm invocations
+# reuse open TLS connections.
+SESSION = boto3.Session()
+
+# The single retry policy of every function: botocore retries throttled and
+# transient failures with exponential backoff and jitter, and adaptive mode
+# rate-limits the client while it is being throttled
+CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    retries={'max_attempts': 5, 'mode': 'adaptive'},
+    tcp_keepalive=True
+)
+
+SM_RUNTIME = SESSION.client('sagemaker-runtime', config=CLIENT_CONFIG)
+LAMBDA = SESSION.client('lambda', config=CLIENT_CONFIG)
+S3 = SESSION.client('s3', config=CLIENT_CONFIG)
+SQS = SESSION.client('sqs', config=CLIENT_CONFIG)
+DYNAMODB = SESSION.resource('dynamodb', config=CLIENT_CONFIG)
+DYNAMODB_CLIENT = DYNAMODB.meta.client
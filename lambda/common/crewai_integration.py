@@ -1,15 +1,15 @@
+import functools
 import json
-import boto3
 import os
-from crewai import Agent, Task, Crew, Process
-
-# Initialize AWS clients
-lambda_client = boto3.client('lambda')
-sagemaker_runtime = boto3.client('sagemaker-runtime')
+from common.aws import LAMBDA as lambda_client
+from common.deepseek_client import SYSTEM_PROMPT, DeepSeekClient
 
 # Get environment variables
 DEEPSEEK_ENDPOINT = os.environ['DEEPSEEK_ENDPOINT']
 
+# Prompt used by the receipt task's extraction tool
+RECEIPT_EXTRACTION_PROMPT = "Extract all grocery items from this receipt image, one per line, as \"name: price\"."
+
 def lambda_handler(event, context):
     """
     CrewAI orchestration Lambda function for the Grocery Management System.
@@ -33,17 +33,19 @@ def lambda_handler(event, context):
         
         image_data = body['image']
         
+        from crewai import Crew, Process
+        
         # Set up the CrewAI agents
         receipt_agent = create_receipt_agent()
         expiration_agent = create_expiration_agent()
         inventory_agent = create_inventory_agent()
         recipe_agent = create_recipe_agent()
         
-        # Define the tasks
+        # Define the tasks, wiring each one to the outputs it depends on
         receipt_task = create_receipt_task(receipt_agent, image_data)
-        expiration_task = create_expiration_task(expiration_agent)
-        inventory_task = create_inventory_task(inventory_agent)
-        recipe_task = create_recipe_task(recipe_agent)
+        expiration_task = create_expiration_task(expiration_agent, receipt_task)
+        inventory_task = create_inventory_task(inventory_agent, expiration_task)
+        recipe_task = create_recipe_task(recipe_agent, inventory_task)
         
         # Create the crew
         crew = Crew(
@@ -70,92 +72,127 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+# Agents are cached so warm Lambda invocations skip their construction
+@functools.lru_cache(maxsize=1)
 def create_receipt_agent():
     """
     Create a CrewAI agent for receipt interpretation.
     """
+    from crewai import Agent
+    
     return Agent(
         role='Receipt Interpreter',
         goal='Extract grocery items from receipt images with high accuracy',
         backstory='You are an expert at analyzing receipts and extracting structured data from them.',
         verbose=True,
-        llm=DeepSeekLLM()  # Custom LLM class for DeepSeek integration
+        llm=_DEEPSEEK_LLM_SINGLETON  # Custom LLM class for DeepSeek integration
     )
 
+@functools.lru_cache(maxsize=1)
 def create_expiration_agent():
     """
     Create a CrewAI agent for expiration date estimation.
     """
+    from crewai import Agent
+    
     return Agent(
         role='Expiration Date Estimator',
         goal='Accurately predict expiration dates for grocery items',
         backstory='You are an expert at food preservation and shelf life estimation.',
         verbose=True,
-        llm=DeepSeekLLM()
+        llm=_DEEPSEEK_LLM_SINGLETON
     )
 
+@functools.lru_cache(maxsize=1)
 def create_inventory_agent():
     """
     Create a CrewAI agent for grocery inventory tracking.
     """
+    from crewai import Agent
+    
     return Agent(
         role='Grocery Tracker',
         goal='Maintain an accurate inventory of grocery items',
         backstory='You are an organized inventory manager who keeps track of all items.',
         verbose=True,
-        llm=DeepSeekLLM()
+        llm=_DEEPSEEK_LLM_SINGLETON
     )
 
+@functools.lru_cache(maxsize=1)
 def create_recipe_agent():
     """
     Create a CrewAI agent for recipe recommendations.
     """
+    from crewai import Agent
+    
     return Agent(
         role='Recipe Recommender',
         goal='Suggest creative and practical recipes based on available ingredients',
         backstory='You are a creative chef who can make delicious meals from any ingredients.',
         verbose=True,
-        llm=DeepSeekLLM()
+        llm=_DEEPSEEK_LLM_SINGLETON
     )
 
 def create_receipt_task(agent, image_data):
     """
     Create a task for receipt interpretation.
+    
+    Task context only accepts other tasks, so the image is bound to the
+    task's extraction tool instead of being sent through the prompt.
     """
+    from crewai import Task
+    from langchain_core.tools import StructuredTool
+    
+    extract_items_tool = StructuredTool.from_function(
+        func=lambda: _DEEPSEEK_LLM_SINGLETON.generate(RECEIPT_EXTRACTION_PROMPT, image=image_data),
+        name="extract_items_from_receipt",
+        description="Extract the grocery items and their prices from the uploaded receipt image."
+    )
+    
     return Task(
-        description=f"Analyze this receipt image and extract all grocery items with their prices. The image data is: {image_data[:100]}...",
+        description="Analyze this receipt image and extract all grocery items with their prices.",
         agent=agent,
-        expected_output="A list of grocery items with their prices"
+        expected_output="A list of grocery items with their prices",
+        tools=[extract_items_tool]
     )
 
-def create_expiration_task(agent):
+def create_expiration_task(agent, receipt_task):
     """
     Create a task for expiration date estimation.
     """
+    from crewai import Task
+    
     return Task(
         description="Estimate the expiration dates for the grocery items extracted from the receipt.",
         agent=agent,
-        expected_output="A list of grocery items with their estimated expiration dates"
+        expected_output="A list of grocery items with their estimated expiration dates",
+        context=[receipt_task]
     )
 
-def create_inventory_task(agent):
+def create_inventory_task(agent, expiration_task):
     """
     Create a task for inventory tracking.
     """
+    from crewai import Task
+    
     return Task(
         description="Update the grocery inventory with the new items and their expiration dates.",
         agent=agent,
-        expected_output="Updated inventory status"
+        expected_output="Updated inventory status",
+        context=[expiration_task]
     )
 
-def create_recipe_task(agent):
+def create_recipe_task(agent, inventory_task):
     """
     Create a task for recipe recommendation.
     """
+    from crewai import Task
+    
     return Task(
         description="Recommend recipes based on the current grocery inventory, prioritizing items that will expire soon.",
         agent=agent,
-        expected_output="A list of recommended recipes using available ingredients"
+        expected_output="A list of recommended recipes using available ingredients",
+        context=[inventory_task]
     )
 
 class DeepSeekLLM:
@@ -164,34 +201,24 @@ class DeepSeekLLM:
     """
     def __init__(self):
         self.endpoint_name = DEEPSEEK_ENDPOINT
+        
+        # The client invokes the endpoint according to DEEPSEEK_INFERENCE_MODE
+        self.client = DeepSeekClient(DEEPSEEK_ENDPOINT)
     
     def generate(self, prompt, **kwargs):
         """
         Generate a response from DeepSeek.
         """
-        # Prepare the payload for DeepSeek
-        payload = {
-            "prompt": prompt,
-            "max_tokens": kwargs.get('max_tokens', 1000),
-            "temperature": kwargs.get('temperature', 0.2)
-        }
+        # Prompts go behind the shared prompt prefix
+        prompt = SYSTEM_PROMPT + prompt
+        max_tokens = kwargs.get('max_tokens', 1000)
+        temperature = kwargs.get('temperature', 0.2)
         
         # Add image if present
         if 'image' in kwargs:
-            payload['image_base64'] = kwargs['image']
-        
-        # Invoke the DeepSeek endpoint
-        response = sagemaker_runtime.invoke_endpoint(
-            EndpointName=self.endpoint_name,
-            ContentType='application/json',
-            Body=json.dumps(payload)
-        )
+            return self.client.process_image(kwargs['image'], prompt, max_tokens, temperature)
         
-        # Parse the response
-        result = json.loads(response['Body'].read().decode())
-        
-        # Return the generated text
-        if 'generated_text' in result:
-            return result['generated_text']
-        else:
-            raise Exception("Failed to generate response from DeepSeek")
+        return self.client.generate_text(prompt, max_tokens, temperature)
+
+# DeepSeekLLM holds no per-request state, so every agent shares one instance
+_DEEPSEEK_LLM_SINGLETON = DeepSeekLLM()
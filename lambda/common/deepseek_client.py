@@ -1,6 +1,33 @@
-import boto3
+import asyncio
 import json
 import os
+import re
+from common.async_inference import invoke_endpoint_async
+from common.aws import SM_RUNTIME
+from common.llm_cache import LLMCache
+
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from json import dumps as json_dumps, loads as json_loads
+
+# Shared prefix for every DeepSeek prompt, so all prompts frame the task the
+# same way
+SYSTEM_PROMPT = (
+    "You are an expert assistant for a grocery management system. "
+    "Follow the task below precisely and output valid JSON whenever a format is requested.\n\n"
+)
+
+# Possible starts of the JSON in a model response: an object, or an array of
+# objects (possibly empty), so bracketed prose such as "[1]" is skipped
+_JSON_START_RE = re.compile(r'\{|\[\s*[{\]]')
+_JSON_DECODER = json.JSONDecoder()
+
+# Responses are only cached for near-deterministic sampling temperatures
+CACHEABLE_TEMPERATURE = 0.2
+
+# Shared across DeepSeekClient instances so warm Lambda invocations reuse it
+_RESPONSE_CACHE = LLMCache()
 
 class DeepSeekClient:
     """
@@ -10,21 +37,36 @@ class DeepSeekClient:
     1. Invoke the DeepSeek model for text generation
     2. Process images with DeepSeek vision capabilities
     3. Handle structured output from DeepSeek
+    
+    Each method has an ``a``-prefixed coroutine counterpart so independent
+    calls can be awaited together with ``asyncio.gather``.
     """
     
-    def __init__(self, endpoint_name=None):
+    def __init__(self, endpoint_name=None, inference_mode=None, input_bucket=None):
         """
         Initialize the DeepSeek client.
         
         Args:
             endpoint_name (str, optional): The name of the SageMaker endpoint.
                 If not provided, it will be read from the DEEPSEEK_ENDPOINT environment variable.
+            inference_mode (str, optional): How the endpoint is served: realtime, serverless or async.
+                If not provided, it will be read from the DEEPSEEK_INFERENCE_MODE environment variable
+                and defaults to realtime.
+            input_bucket (str, optional): S3 bucket for asynchronous inference payloads.
+                If not provided, it will be read from the DEEPSEEK_ASYNC_INPUT_BUCKET environment variable.
         """
         self.endpoint_name = endpoint_name or os.environ.get('DEEPSEEK_ENDPOINT')
         if not self.endpoint_name:
             raise ValueError("DeepSeek endpoint name must be provided or set in DEEPSEEK_ENDPOINT environment variable")
         
-        self.sagemaker_runtime = boto3.client('sagemaker-runtime')
+        self.inference_mode = inference_mode or os.environ.get('DEEPSEEK_INFERENCE_MODE', 'realtime')
+        self.async_mode = self.inference_mode == 'async'
+        self.input_bucket = input_bucket or os.environ.get('DEEPSEEK_ASYNC_INPUT_BUCKET')
+        if self.async_mode and not self.input_bucket:
+            raise ValueError("An input bucket must be provided or set in DEEPSEEK_ASYNC_INPUT_BUCKET environment variable when using asynchronous inference")
+        
+        self.sagemaker_runtime = SM_RUNTIME
+        self.cache = _RESPONSE_CACHE
     
     def generate_text(self, prompt, max_tokens=1000, temperature=0.2):
         """
@@ -79,40 +121,62 @@ class DeepSeekClient:
             temperature (float, optional): Temperature for sampling. Defaults to 0.2.
                 
         Returns:
-            dict: The parsed structured output
+            dict or list: The parsed structured output
         """
-        # Enhance the prompt to request structured output
-        enhanced_prompt = f"""
-        {prompt}
-        
-        Please provide your response in the following format:
-        {output_format}
-        
-        Ensure your response is valid JSON and contains only the requested structure.
-        """
-        
         payload = {
-            "prompt": enhanced_prompt,
+            "prompt": self._enhance_structured_prompt(prompt, output_format),
             "max_tokens": max_tokens,
             "temperature": temperature
         }
         
-        response_text = self._invoke_endpoint(payload)
+        # Serve low-temperature payloads from the LLM cache
+        cache_key = self._cache_key(payload)
+        response_text = self.cache.get(cache_key) if cache_key else None
+        cache_miss = cache_key is not None and response_text is None
+        if response_text is None:
+            response_text = self._invoke_endpoint(payload)
         
         # Extract and parse JSON from the response
         try:
-            # Try to find JSON in the response
-            import re
-            json_match = re.search(r'({.*})', response_text, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group(1))
-            else:
-                raise ValueError("No JSON found in the response")
-        except (json.JSONDecodeError, ValueError) as e:
+            result = extract_json(response_text)
+        except ValueError as e:
             print(f"Error parsing structured output: {str(e)}")
             print(f"Raw response: {response_text}")
             # Return the raw text if parsing fails
             return {"raw_response": response_text}
+        
+        # Only cache new responses that parsed, so a malformed answer is not replayed
+        if cache_miss:
+            self.cache.put(cache_key, response_text)
+        
+        return result
+    
+    async def agenerate_text(self, prompt, max_tokens=1000, temperature=0.2):
+        """
+        Asynchronous version of generate_text.
+        """
+        return await asyncio.to_thread(self.generate_text, prompt, max_tokens, temperature)
+    
+    async def aprocess_image(self, image_base64, prompt, max_tokens=1000, temperature=0.2):
+        """
+        Asynchronous version of process_image.
+        """
+        return await asyncio.to_thread(self.process_image, image_base64, prompt, max_tokens, temperature)
+    
+    async def agenerate_structured_output(self, prompt, output_format, max_tokens=2000, temperature=0.2):
+        """
+        Asynchronous version of generate_structured_output.
+        """
+        return await asyncio.to_thread(self.generate_structured_output, prompt, output_format, max_tokens, temperature)
+    
+    def _cache_key(self, payload):
+        """
+        Return the LLM cache key for a payload, or None if its responses should not be cached.
+        """
+        if payload.get('temperature', 1.0) > CACHEABLE_TEMPERATURE:
+            return None
+        
+        return LLMCache.cache_key(payload)
     
     def _invoke_endpoint(self, payload):
         """
@@ -124,17 +188,66 @@ class DeepSeekClient:
         Returns:
             str: The generated text from the model
         """
-        response = self.sagemaker_runtime.invoke_endpoint(
-            EndpointName=self.endpoint_name,
-            ContentType='application/json',
-            Body=json.dumps(payload)
-        )
+        if self.async_mode:
+            response_body = self._invoke_endpoint_async(payload)
+        else:
+            response = self.sagemaker_runtime.invoke_endpoint(
+                EndpointName=self.endpoint_name,
+                ContentType='application/json',
+                Body=json_dumps(payload)
+            )
+            response_body = response['Body'].read().decode()
         
         # Parse the response
-        result = json.loads(response['Body'].read().decode())
+        result = json_loads(response_body)
         
         # Extract the generated text
         if 'generated_text' in result:
             return result['generated_text']
         else:
             raise Exception("Failed to generate response from DeepSeek endpoint")
+    
+    def _enhance_structured_prompt(self, prompt, output_format):
+        """
+        Enhance a prompt to request structured output.
+        """
+        return f"""{prompt}
+        
+        Please provide your response in the following format:
+        {output_format}
+        
+        Ensure your response is valid JSON and contains only the requested structure.
+        """
+    
+    def _invoke_endpoint_async(self, payload):
+        """
+        Invoke an asynchronous inference endpoint and wait for its output.
+        
+        Args:
+            payload (dict): The payload to send to the endpoint
+                
+        Returns:
+            bytes: The raw response body written by the endpoint
+        """
+        return invoke_endpoint_async(self.endpoint_name, json_dumps(payload), self.input_bucket)
+
+def extract_json(text):
+    """
+    Decode the first JSON object or array of objects embedded in model output.
+    
+    Each candidate opening bracket is tried in turn until one decodes, so
+    prose before or after the JSON is ignored.
+    
+    Args:
+        text (str): The generated text
+            
+    Returns:
+        dict or list: The decoded JSON
+    """
+    for match in _JSON_START_RE.finditer(text):
+        try:
+            return _JSON_DECODER.raw_decode(text, match.start())[0]
+        except json.JSONDecodeError:
+            continue
+    
+    raise ValueError("No JSON found in the response")
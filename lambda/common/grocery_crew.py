@@ -1,8 +1,95 @@
+import asyncio
 import json
 import boto3
+import math
 import os
-from crewai import Agent, Task, Crew, Process
-from common.deepseek_client import DeepSeekClient
+import re
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from common.deepseek_client import SYSTEM_PROMPT, DeepSeekClient, extract_json
+from common.shelf_life_cache import ShelfLifeCache, normalize_item_name
+
+# Matches a "name: price" receipt line, capturing the first price after the colon
+_LINE_RE = re.compile(r'^(?P<name>[^:\n]+):[^\n]*?(?P<price>\d+\.\d+)', re.MULTILINE)
+
+# Prompts are built once per container; only the item lists vary per call.
+# They all start with SYSTEM_PROMPT.
+RECEIPT_PROMPT = SYSTEM_PROMPT + """
+        You are an expert at extracting information from grocery receipts.
+        Please analyze this receipt image and extract all grocery items with their prices.
+        Format the output as a JSON array of items, where each item has a 'name' and 'price' field.
+        """
+
+EXPIRATION_PROMPT_TEMPLATE = SYSTEM_PROMPT + """
+        You are an expert at estimating expiration dates for grocery items.
+        Please estimate the typical shelf life (in days) for each of the grocery items in the following JSON array:
+        
+        {items_list}
+        
+        Respond with one JSON array element per input element, preserving order.
+        Format your response as JSON: [{{"name": "item name", "shelf_life_days": days}}, ...]
+        """
+
+EXPIRATION_OUTPUT_FORMAT = '[{"name": "item name", "shelf_life_days": days}, ...]'
+
+RECIPE_PROMPT_TEMPLATE = SYSTEM_PROMPT + """
+        You are a creative chef who specializes in creating recipes from available ingredients.
+        Please suggest 3 recipes that can be made using some or all of the following ingredients:
+        
+        {items_list}
+        
+        For each recipe, provide:
+        1. Recipe name
+        2. Ingredients needed (indicate which ones are from the provided list)
+        3. Brief cooking instructions
+        4. Approximate cooking time in minutes
+        
+        Format your response as JSON with the following structure:
+        [
+            {{
+                "name": "Recipe Name",
+                "ingredients": ["Ingredient 1", "Ingredient 2", ...],
+                "instructions": "Brief cooking instructions",
+                "cooking_time_minutes": 30
+            }},
+            ...
+        ]
+        """
+
+RECIPE_OUTPUT_FORMAT = '[{"name": "Recipe Name", "ingredients": ["Ingredient 1", "Ingredient 2"], "instructions": "Brief cooking instructions", "cooking_time_minutes": 30}, ...]'
+
+# Maximum number of items sent to DeepSeek in a single expiration estimate
+EXPIRATION_BATCH_SIZE = 25
+
+# Output token budget of an expiration estimate: a floor that leaves room for
+# the model's reasoning, raised per item for large batches
+EXPIRATION_MIN_TOKENS = 1000
+TOKENS_PER_ESTIMATE = 50
+
+# Maximum number of ingredients, nearest expiration first, offered to the recipe agent
+RECIPE_MAX_ITEMS = 20
+
+# Shared across crews so warm Lambda invocations reuse earlier estimates
+_SHELF_LIFE_CACHE = ShelfLifeCache()
+
+# Minimum character trigram similarity for a fuzzy shelf life match
+SHELF_LIFE_MATCH_THRESHOLD = 0.5
+
+def _char_trigrams(text):
+    """
+    Return the set of character trigrams of a padded string.
+    """
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _shelf_life_days(entry):
+    """
+    Return the shelf life in days of an estimate entry, or None if it is malformed.
+    """
+    try:
+        return int(entry['shelf_life_days'])
+    except (KeyError, TypeError, ValueError):
+        return None
 
 class GroceryManagementCrew:
     """
@@ -21,6 +108,7 @@ class GroceryManagementCrew:
         """
         # Initialize DeepSeek client
         self.deepseek_client = DeepSeekClient()
+        self.shelf_life_cache = _SHELF_LIFE_CACHE
         
         # Set up the agents
         self.receipt_agent = self._create_receipt_agent()
@@ -38,11 +126,13 @@ class GroceryManagementCrew:
         Returns:
             dict: Results of the workflow execution
         """
-        # Define the tasks
+        # Define the tasks, wiring each one to the outputs it depends on
         receipt_task = self._create_receipt_task(receipt_image_base64)
-        expiration_task = self._create_expiration_task()
-        inventory_task = self._create_inventory_task()
-        recipe_task = self._create_recipe_task()
+        expiration_task = self._create_expiration_task(receipt_task)
+        inventory_task = self._create_inventory_task(expiration_task)
+        recipe_task = self._create_recipe_task(inventory_task)
+        
+        from crewai import Crew, Process
         
         # Create the crew
         crew = Crew(
@@ -73,6 +163,8 @@ class GroceryManagementCrew:
         """
         Create a CrewAI agent for receipt interpretation.
         """
+        from crewai import Agent
+        
         return Agent(
             role='Receipt Interpreter',
             goal='Extract grocery items from receipt images with high accuracy',
@@ -85,6 +177,8 @@ class GroceryManagementCrew:
         """
         Create a CrewAI agent for expiration date estimation.
         """
+        from crewai import Agent
+        
         return Agent(
             role='Expiration Date Estimator',
             goal='Accurately predict expiration dates for grocery items',
@@ -97,6 +191,8 @@ class GroceryManagementCrew:
         """
         Create a CrewAI agent for grocery inventory tracking.
         """
+        from crewai import Agent
+        
         return Agent(
             role='Grocery Tracker',
             goal='Maintain an accurate inventory of grocery items',
@@ -109,6 +205,8 @@ class GroceryManagementCrew:
         """
         Create a CrewAI agent for recipe recommendations.
         """
+        from crewai import Agent
+        
         return Agent(
             role='Recipe Recommender',
             goal='Suggest creative and practical recipes based on available ingredients',
@@ -120,42 +218,63 @@ class GroceryManagementCrew:
     def _create_receipt_task(self, receipt_image_base64):
         """
         Create a task for receipt interpretation.
+        
+        Task context only accepts other tasks, so the image is bound to the
+        task's extraction tool instead of being sent through the prompt.
         """
+        from crewai import Task
+        from langchain_core.tools import StructuredTool
+        
+        extract_items_tool = StructuredTool.from_function(
+            func=lambda: self._extract_items_from_receipt(receipt_image_base64),
+            name="extract_items_from_receipt",
+            description="Extract the grocery items and their prices from the uploaded receipt image."
+        )
+        
         return Task(
-            description=f"Analyze this receipt image and extract all grocery items with their prices.",
+            description="Analyze this receipt image and extract all grocery items with their prices.",
             agent=self.receipt_agent,
             expected_output="A list of grocery items with their prices",
-            context={"receipt_image": receipt_image_base64}
+            tools=[extract_items_tool]
         )
     
-    def _create_expiration_task(self):
+    def _create_expiration_task(self, receipt_task):
         """
         Create a task for expiration date estimation.
         """
+        from crewai import Task
+        
         return Task(
             description="Estimate the expiration dates for the grocery items extracted from the receipt.",
             agent=self.expiration_agent,
-            expected_output="A list of grocery items with their estimated expiration dates"
+            expected_output="A list of grocery items with their estimated expiration dates",
+            context=[receipt_task]
         )
     
-    def _create_inventory_task(self):
+    def _create_inventory_task(self, expiration_task):
         """
         Create a task for inventory tracking.
         """
+        from crewai import Task
+        
         return Task(
             description="Update the grocery inventory with the new items and their expiration dates.",
             agent=self.inventory_agent,
-            expected_output="Updated inventory status"
+            expected_output="Updated inventory status",
+            context=[expiration_task]
         )
     
-    def _create_recipe_task(self):
+    def _create_recipe_task(self, inventory_task):
         """
         Create a task for recipe recommendation.
         """
+        from crewai import Task
+        
         return Task(
             description="Recommend recipes based on the current grocery inventory, prioritizing items that will expire soon.",
             agent=self.recipe_agent,
-            expected_output="A list of recommended recipes using available ingredients"
+            expected_output="A list of recommended recipes using available ingredients",
+            context=[inventory_task]
         )
     
     def _extract_items_from_receipt(self, receipt_image_base64):
@@ -168,40 +287,28 @@ class GroceryManagementCrew:
         Returns:
             list: Extracted grocery items
         """
-        prompt = """
-        You are an expert at extracting information from grocery receipts.
-        Please analyze this receipt image and extract all grocery items with their prices.
-        Format the output as a JSON array of items, where each item has a 'name' and 'price' field.
-        """
-        
         # Process the image with DeepSeek
         result = self.deepseek_client.process_image(
             receipt_image_base64,
-            prompt,
+            RECEIPT_PROMPT,
             max_tokens=1000,
             temperature=0.2
         )
         
         # Try to parse the result as JSON
         try:
-            import re
-            json_match = re.search(r'(\[.*\])', result, re.DOTALL)
-            if json_match:
-                items = json.loads(json_match.group(1))
+            try:
+                items = extract_json(result)
+            except ValueError:
+                items = None
+            if isinstance(items, list):
                 return items
             else:
-                # If no JSON array is found, try to parse manually
-                items = []
-                lines = result.strip().split('\n')
-                for line in lines:
-                    if ':' in line:
-                        parts = line.split(':', 1)
-                        name = parts[0].strip()
-                        price_match = re.search(r'(\d+\.\d+)', parts[1])
-                        if price_match:
-                            price = float(price_match.group(1))
-                            items.append({"name": name, "price": price})
-                return items
+                # If no JSON array is found, parse "name: price" lines in one pass
+                return [
+                    {"name": match['name'].strip(), "price": float(match['price'])}
+                    for match in _LINE_RE.finditer(result)
+                ]
         except Exception as e:
             print(f"Error parsing receipt items: {str(e)}")
             return []
@@ -216,54 +323,34 @@ class GroceryManagementCrew:
         Returns:
             list: Items with estimated expiration dates
         """
-        # Prepare the list of items for DeepSeek
-        items_list = "\n".join([f"{item['name']}" for item in items])
+        # Reuse shelf lives already estimated for equivalent item names
+        item_keys = [normalize_item_name(item['name']) for item in items]
+        cached_shelf_lives = self.shelf_life_cache.get_many(item_keys)
         
-        prompt = f"""
-        You are an expert at estimating expiration dates for grocery items.
-        Please estimate the typical shelf life (in days) for each of the following grocery items:
+        # Only ask DeepSeek about the items that are not cached
+        miss_items = list({
+            key: item for key, item in zip(item_keys, items)
+            if key not in cached_shelf_lives
+        }.values())
         
-        {items_list}
-        
-        For each item, provide only the name and the number of days until expiration.
-        Format your response as JSON: [{"name": "item name", "shelf_life_days": days}, ...]
-        """
-        
-        # Get expiration estimates from DeepSeek
-        output_format = '[{"name": "item name", "shelf_life_days": days}, ...]'
-        result = self.deepseek_client.generate_structured_output(
-            prompt,
-            output_format,
-            max_tokens=1000,
-            temperature=0.2
-        )
+        shelf_life_map = {}
+        if miss_items:
+            # Get expiration estimates from DeepSeek, one concurrent request per batch
+            shelf_life_map = asyncio.run(self._aestimate_shelf_lives(miss_items))
+            self.shelf_life_cache.put_many(shelf_life_map)
         
         # If we got a valid result
-        if isinstance(result, list):
-            # Create a mapping of item name to shelf life
-            shelf_life_map = {item['name'].lower(): item['shelf_life_days'] for item in result}
+        if cached_shelf_lives or shelf_life_map:
+            shelf_life_index = self._index_shelf_lives(shelf_life_map)
             
             # Update the original items with expiration dates
-            from datetime import datetime, timedelta
             today = datetime.now()
             
-            for item in items:
-                item_name = item['name'].lower()
-                # Find the closest match in our shelf life map
-                best_match = None
-                best_score = 0
-                for name in shelf_life_map:
-                    if item_name in name or name in item_name:
-                        score = len(name) / max(len(item_name), len(name))
-                        if score > best_score:
-                            best_score = score
-                            best_match = name
-                
-                if best_match and best_score > 0.5:
-                    days = shelf_life_map[best_match]
+            for item, item_key in zip(items, item_keys):
+                if item_key in cached_shelf_lives:
+                    days = cached_shelf_lives[item_key]
                 else:
-                    # Default to 7 days if no match found
-                    days = 7
+                    days = self._match_shelf_life(item_key, shelf_life_map, shelf_life_index)
                 
                 # Add expiration date to the item
                 expiration_date = today + timedelta(days=days)
@@ -272,6 +359,122 @@ class GroceryManagementCrew:
         
         return items
     
+    def _index_shelf_lives(self, shelf_life_map):
+        """
+        Build a character trigram index over the estimated item names.
+        
+        Args:
+            shelf_life_map (dict): Shelf life in days keyed by normalized item name
+            
+        Returns:
+            tuple: Names keyed by trigram, and the trigram count of each name
+        """
+        names_by_trigram = defaultdict(list)
+        trigram_counts = {}
+        for name in shelf_life_map:
+            trigrams = _char_trigrams(name)
+            trigram_counts[name] = len(trigrams)
+            for trigram in trigrams:
+                names_by_trigram[trigram].append(name)
+        
+        return names_by_trigram, trigram_counts
+    
+    def _match_shelf_life(self, item_key, shelf_life_map, shelf_life_index):
+        """
+        Find the shelf life estimated for the closest matching item name.
+        
+        Names are compared by the cosine similarity of their character
+        trigram sets, looked up through the trigram index so only names
+        sharing at least one trigram are scored.
+        
+        Args:
+            item_key (str): Normalized item name
+            shelf_life_map (dict): Shelf life in days keyed by normalized item name
+            shelf_life_index (tuple): Index built by _index_shelf_lives
+            
+        Returns:
+            int: Shelf life in days, defaulting to 7 if no match is found
+        """
+        if item_key in shelf_life_map:
+            return shelf_life_map[item_key]
+        
+        names_by_trigram, trigram_counts = shelf_life_index
+        item_trigrams = _char_trigrams(item_key)
+        
+        # Count the trigrams each candidate name shares with the item
+        overlaps = Counter()
+        for trigram in item_trigrams:
+            overlaps.update(names_by_trigram.get(trigram, ()))
+        
+        # Find the closest match in our shelf life map
+        best_match = None
+        best_score = 0
+        for name, overlap in overlaps.items():
+            score = overlap / math.sqrt(len(item_trigrams) * trigram_counts[name])
+            if score > best_score:
+                best_score = score
+                best_match = name
+        
+        if best_match and best_score > SHELF_LIFE_MATCH_THRESHOLD:
+            return shelf_life_map[best_match]
+        
+        # Default to 7 days if no match found
+        return 7
+    
+    async def _aestimate_shelf_lives(self, items):
+        """
+        Request shelf life estimates for batches of items concurrently.
+        
+        Args:
+            items (list): List of grocery items
+            
+        Returns:
+            dict: Shelf life in days keyed by normalized item name
+        """
+        batches = [
+            items[i:i + EXPIRATION_BATCH_SIZE]
+            for i in range(0, len(items), EXPIRATION_BATCH_SIZE)
+        ]
+        batch_results = await asyncio.gather(*(
+            self.deepseek_client.agenerate_structured_output(
+                self._build_expiration_prompt(batch),
+                EXPIRATION_OUTPUT_FORMAT,
+                max_tokens=max(EXPIRATION_MIN_TOKENS, TOKENS_PER_ESTIMATE * len(batch)),
+                temperature=0.2
+            )
+            for batch in batches
+        ))
+        
+        shelf_life_map = {}
+        for batch, result in zip(batches, batch_results):
+            if not isinstance(result, list):
+                continue
+            
+            # Malformed entries (such as "7 days" or null) are skipped, so
+            # their items fall back to a matched or default shelf life
+            if len(result) == len(batch):
+                # Answers are returned in input order, so align them by index
+                for item, entry in zip(batch, result):
+                    days = _shelf_life_days(entry)
+                    if days is not None:
+                        shelf_life_map[normalize_item_name(item['name'])] = days
+            else:
+                # Fall back to the names the model echoed back
+                for entry in result:
+                    days = _shelf_life_days(entry)
+                    if days is not None and isinstance(entry.get('name'), str):
+                        shelf_life_map[normalize_item_name(entry['name'])] = days
+        
+        return shelf_life_map
+    
+    def _build_expiration_prompt(self, items):
+        """
+        Build the shelf life estimation prompt for a batch of items.
+        """
+        items_list = json.dumps([{"name": item['name']} for item in items])
+        
+        return EXPIRATION_PROMPT_TEMPLATE.format(items_list=items_list)
+    
     def _update_inventory(self, items):
         """
         Tool for updating the grocery inventory.
@@ -300,40 +503,20 @@ class GroceryManagementCrew:
         Returns:
             list: Recommended recipes
         """
-        # Extract item names from inventory
+        # List the items expiring soonest first, with their use-by dates
         items = inventory.get('inventory', [])
-        item_names = [item['name'] for item in items]
-        items_list = ", ".join(item_names)
-        
-        prompt = f"""
-        You are a creative chef who specializes in creating recipes from available ingredients.
-        Please suggest 3 recipes that can be made using some or all of the following ingredients:
-        
-        {items_list}
-        
-        For each recipe, provide:
-        1. Recipe name
-        2. Ingredients needed (indicate which ones are from the provided list)
-        3. Brief cooking instructions
-        4. Approximate cooking time in minutes
+        sorted_items = sorted(items, key=lambda item: item.get('expiration_date', '9999-12-31'))[:RECIPE_MAX_ITEMS]
+        items_list = "\n".join(
+            f"- {item['name']} (expires {item.get('expiration_date', 'unknown')})"
+            for item in sorted_items
+        )
         
-        Format your response as JSON with the following structure:
-        [
-            {{
-                "name": "Recipe Name",
-                "ingredients": ["Ingredient 1", "Ingredient 2", ...],
-                "instructions": "Brief cooking instructions",
-                "cooking_time_minutes": 30
-            }},
-            ...
-        ]
-        """
+        prompt = RECIPE_PROMPT_TEMPLATE.format(items_list=items_list)
         
         # Get recipe recommendations from DeepSeek
-        output_format = '[{"name": "Recipe Name", "ingredients": ["Ingredient 1", "Ingredient 2"], "instructions": "Brief cooking instructions", "cooking_time_minutes": 30}, ...]'
         result = self.deepseek_client.generate_structured_output(
             prompt,
-            output_format,
+            RECIPE_OUTPUT_FORMAT,
             max_tokens=2000,
             temperature=0.7
         )
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from common.aws import DYNAMODB
+
+# Default lifetime of a cached response (7 days)
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Maximum number of responses kept in memory per Lambda container
+DEFAULT_MAX_ENTRIES = 256
+
+class LLMCache:
+    """
+    Cache for deterministic DeepSeek responses.
+    
+    This class:
+    1. Keeps recently used responses in an in-process LRU with a TTL
+    2. Optionally persists responses in a DynamoDB table (LLM_CACHE_TABLE)
+       whose ExpiresAt attribute is used as the table TTL
+    """
+    
+    def __init__(self, table_name=None, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Initialize the cache.
+        
+        Args:
+            table_name (str, optional): DynamoDB table used as the shared cache tier.
+                If not provided, it will be read from the LLM_CACHE_TABLE environment variable.
+                When neither is set only the in-process tier is used.
+            ttl_seconds (int, optional): Lifetime of cached responses. Defaults to 7 days.
+            max_entries (int, optional): Size of the in-process tier. Defaults to 256.
+        """
+        self.table_name = table_name or os.environ.get('LLM_CACHE_TABLE')
+        self.table = DYNAMODB.Table(self.table_name) if self.table_name else None
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+    
+    @staticmethod
+    def cache_key(payload):
+        """
+        Build the cache key for an endpoint payload.
+        
+        Args:
+            payload (dict): The payload sent to the endpoint
+            
+        Returns:
+            str: SHA-256 hex digest of the canonical JSON payload
+        """
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    
+    def get(self, key):
+        """
+        Look up a cached response.
+        
+        Args:
+            key (str): The cache key
+            
+        Returns:
+            str: The cached response, or None on a miss
+        """
+        now = time.time()
+        
+        entry = self._entries.get(key)
+        if entry:
+            response, expires_at = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                return response
+            del self._entries[key]
+        
+        if self.table is None:
+            return None
+        
+        try:
+            item = self.table.get_item(Key={'CacheKey': key}).get('Item')
+        except ClientError as e:
+            print(f"Error reading LLM cache: {str(e)}")
+            return None
+        
+        # DynamoDB TTL deletion is lazy, so expired items may still be returned
+        if item and int(item['ExpiresAt']) > now:
+            self._remember(key, item['Response'], int(item['ExpiresAt']))
+            return item['Response']
+        
+        return None
+    
+    def put(self, key, response):
+        """
+        Store a response in the cache.
+        
+        Args:
+            key (str): The cache key
+            response (str): The generated text to cache
+        """
+        expires_at = int(time.time()) + self.ttl_seconds
+        self._remember(key, response, expires_at)
+        
+        if self.table is None:
+            return
+        
+        try:
+            self.table.put_item(Item={
+                'CacheKey': key,
+                'Response': response,
+                'ExpiresAt': expires_at
+            })
+        except ClientError as e:
+            print(f"Error writing LLM cache: {str(e)}")
+    
+    def _remember(self, key, response, expires_at):
+        """
+        Add a response to the in-process tier, evicting the least recently used entry.
+        """
+        self._entries[key] = (response, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,116 @@
+import os
+import random
+import re
+import time
+from botocore.exceptions import ClientError
+from common.aws import DYNAMODB
+
+# Maximum number of keys accepted by a single BatchGetItem request
+BATCH_GET_LIMIT = 100
+
+# Number of BatchGetItem attempts for keys DynamoDB leaves unprocessed
+MAX_BATCH_GET_ATTEMPTS = 5
+
+_TOKEN_RE = re.compile(r'[a-z0-9%]+')
+
+def normalize_item_name(name):
+    """
+    Normalize a grocery item name into a cache key.
+    
+    Names are lowercased, stripped of punctuation and reduced to their sorted
+    set of tokens, so "Whole Milk 2%" and "Milk, 2% Whole" share a key.
+    
+    Shared with expiration_date_estimator/app.py, as both write the
+    ShelfLifeCache table and must produce the same keys.
+    
+    Args:
+        name (str): The item name
+        
+    Returns:
+        str: The normalized name
+    """
+    return " ".join(sorted(set(_TOKEN_RE.findall(name.lower()))))
+
+class ShelfLifeCache:
+    """
+    Cache of shelf life estimates keyed by normalized item name.
+    
+    This class:
+    1. Keeps estimates in memory for the lifetime of the Lambda container
+    2. Optionally persists estimates in a DynamoDB table (SHELF_LIFE_CACHE_TABLE)
+    """
+    
+    def __init__(self, table_name=None):
+        """
+        Initialize the cache.
+        
+        Args:
+            table_name (str, optional): DynamoDB table used as the shared cache tier.
+                If not provided, it will be read from the SHELF_LIFE_CACHE_TABLE environment variable.
+                When neither is set only the in-process tier is used.
+        """
+        self.table_name = table_name or os.environ.get('SHELF_LIFE_CACHE_TABLE')
+        self.dynamodb = DYNAMODB if self.table_name else None
+        self._entries = {}
+    
+    def get_many(self, keys):
+        """
+        Look up the shelf lives for several normalized names.
+        
+        Args:
+            keys (list): Normalized item names
+            
+        Returns:
+            dict: Shelf life in days for every key that was found
+        """
+        found = {key: self._entries[key] for key in keys if key in self._entries}
+        missing = [key for key in dict.fromkeys(keys) if key and key not in found]
+        
+        if self.dynamodb is None or not missing:
+            return found
+        
+        try:
+            for i in range(0, len(missing), BATCH_GET_LIMIT):
+                request = {
+                    self.table_name: {
+                        'Keys': [{'NormalizedName': key} for key in missing[i:i + BATCH_GET_LIMIT]]
+                    }
+                }
+                for attempt in range(MAX_BATCH_GET_ATTEMPTS):
+                    if attempt:
+                        # Back off before resending the keys DynamoDB did not process
+                        time.sleep(min(0.1 * 2 ** attempt + random.random() * 0.1, 5))
+                    response = self.dynamodb.batch_get_item(RequestItems=request)
+                    for item in response['Responses'].get(self.table_name, []):
+                        days = int(item['ShelfLifeDays'])
+                        self._entries[item['NormalizedName']] = days
+                        found[item['NormalizedName']] = days
+                    request = response.get('UnprocessedKeys')
+                    if not request:
+                        break
+        except ClientError as e:
+            print(f"Error reading shelf life cache: {str(e)}")
+        
+        return found
+    
+    def put_many(self, shelf_lives):
+        """
+        Store shelf life estimates.
+        
+        Args:
+            shelf_lives (dict): Shelf life in days keyed by normalized item name
+        """
+        self._entries.update(shelf_lives)
+        
+        if self.dynamodb is None or not shelf_lives:
+            return
+        
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            with table.batch_writer() as batch:
+                for key, days in shelf_lives.items():
+                    if not key:
+                        continue
+                    batch.put_item(Item={'NormalizedName': key, 'ShelfLifeDays': days})
+        except ClientError as e:
+            print(f"Error writing shelf life cache: {str(e)}")
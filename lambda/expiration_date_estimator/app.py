@@ -1,15 +1,46 @@
 import json
-import boto3
 import os
-from datetime import datetime, timedelta
-
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-sagemaker_runtime = boto3.client('sagemaker-runtime')
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Key
+from datetime import date, datetime, timedelta
+from common.async_inference import invoke_endpoint_async
+from common.aws import DYNAMODB as dynamodb, SM_RUNTIME as sagemaker_runtime
+from common.shelf_life_cache import normalize_item_name
 
 # Get environment variables
 GROCERY_TABLE = os.environ['GROCERY_TABLE']
 DEEPSEEK_ENDPOINT = os.environ['DEEPSEEK_ENDPOINT']
+SHELF_LIFE_CACHE_TABLE = os.environ.get('SHELF_LIFE_CACHE_TABLE')
+DEEPSEEK_INFERENCE_MODE = os.environ.get('DEEPSEEK_INFERENCE_MODE', 'realtime')
+DEEPSEEK_ASYNC_INPUT_BUCKET = os.environ.get('DEEPSEEK_ASYNC_INPUT_BUCKET')
+
+# Grocery table handle, created once per container
+TABLE = dynamodb.Table(GROCERY_TABLE)
+
+# Global secondary index on GroceryItems keyed by ReceiptId
+RECEIPT_INDEX = 'ReceiptId-index'
+
+# Partition value of the Expiration-index GSI, set on every item with an
+# expiration date so expiring items can be queried by date range
+EXPIRING_BUCKET = 'active'
+
+# Output token budget per item in the estimate prompt ("Item name: X days")
+TOKENS_PER_ESTIMATE = 20
+
+# Number of concurrent UpdateItem calls when writing expiration dates
+UPDATE_WORKERS = 10
+
+# Maximum number of keys accepted by a single BatchGetItem request
+BATCH_GET_LIMIT = 100
+
+# Number of BatchGetItem attempts for keys DynamoDB leaves unprocessed
+MAX_BATCH_GET_ATTEMPTS = 5
+
+_ESTIMATE_LINE_RE = re.compile(r'^[ \t]*([^:\n]*?)[ \t]*:[^\d\n]*(\d+)', re.MULTILINE)
 
 def lambda_handler(event, context):
     """
@@ -41,11 +72,8 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': f'No items found for receipt_id: {receipt_id}'})
             }
         
-        # Estimate expiration dates for the items
-        updated_items = estimate_expiration_dates(grocery_items)
-        
-        # Update the items in DynamoDB
-        update_grocery_items(updated_items)
+        # Estimate expiration dates for the items and update them in DynamoDB
+        updated_items = update_grocery_items(estimate_expiration_dates(grocery_items))
         
         return {
             'statusCode': 200,
@@ -63,30 +91,108 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+def batch_handler(event, context):
+    """
+    SQS-triggered Lambda function to estimate expiration dates for several receipts at once.
+    
+    Receipts queued by the orchestrator arrive in batches, and the items of every
+    receipt in a batch are estimated with a single DeepSeek call. Shelf life does
+    not depend on the receipt, so item names are de-duplicated across receipts and
+    each estimate is applied to every matching item.
+    
+    Failed messages are reported individually (ReportBatchItemFailures), so only
+    they are retried by SQS and moved to the dead-letter queue once they have
+    been received too many times. A failed DeepSeek call or update fails every
+    receipt in the batch.
+    """
+    failed_message_ids = []
+    
+    # Message IDs by receipt ID; a receipt may be queued more than once
+    message_ids = {}
+    for record in event.get('Records', []):
+        try:
+            receipt_id = json.loads(record['body'])['receipt_id']
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Malformed message {record['messageId']}: {str(e)}")
+            failed_message_ids.append(record['messageId'])
+            continue
+        message_ids.setdefault(receipt_id, []).append(record['messageId'])
+    
+    # Get the grocery items for all receipts in the batch
+    grocery_items = []
+    batch_message_ids = []
+    for receipt_id, receipt_message_ids in message_ids.items():
+        try:
+            grocery_items.extend(get_grocery_items(receipt_id))
+        except ClientError as e:
+            print(f"Error getting items for receipt {receipt_id}: {str(e)}")
+            failed_message_ids.extend(receipt_message_ids)
+            continue
+        batch_message_ids.extend(receipt_message_ids)
+    
+    if grocery_items:
+        # Estimate expiration dates and update the items in DynamoDB
+        try:
+            updated_items = update_grocery_items(estimate_expiration_dates(grocery_items))
+            print(f"Estimated expiration dates for {len(updated_items)} items from {len(batch_message_ids)} messages")
+        except Exception as e:
+            print(f"Error estimating expiration dates: {str(e)}")
+            failed_message_ids.extend(batch_message_ids)
+    
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
+
 def get_grocery_items(receipt_id):
     """
     Retrieve grocery items from DynamoDB for a specific receipt.
     """
-    table = dynamodb.Table(GROCERY_TABLE)
+    # Query items by receipt ID through the ReceiptId GSI
+    # Only the attributes used to estimate and write expiration dates
+    query_kwargs = {
+        'IndexName': RECEIPT_INDEX,
+        'KeyConditionExpression': Key('ReceiptId').eq(receipt_id),
+        'ProjectionExpression': 'ItemId, #n, PurchaseDate',
+        'ExpressionAttributeNames': {'#n': 'Name'}
+    }
+    response = TABLE.query(**query_kwargs)
+    items = response.get('Items', [])
     
-    # Query items by receipt ID
-    response = table.scan(
-        FilterExpression="ReceiptId = :receipt_id",
-        ExpressionAttributeValues={
-            ":receipt_id": receipt_id
-        }
-    )
+    # Handle pagination
+    while 'LastEvaluatedKey' in response:
+        response = TABLE.query(ExclusiveStartKey=response['LastEvaluatedKey'], **query_kwargs)
+        items.extend(response.get('Items', []))
     
-    return response.get('Items', [])
+    return items
 
 def estimate_expiration_dates(grocery_items):
     """
     Use DeepSeek AI to estimate expiration dates for grocery items.
+    
+    Items are yielded as soon as their expiration date is known: cached items
+    first, then the items DeepSeek estimated, and finally items DeepSeek did
+    not estimate, with the default shelf life.
     """
-    updated_items = []
+    # Look up cached shelf lives so only unseen items are sent to DeepSeek
+    normalized_names = {item['Name']: normalize_item_name(item['Name']) for item in grocery_items}
+    shelf_lives = get_cached_shelf_lives(normalized_names.values())
+    
+    # Items still waiting for an estimate, by normalized name
+    pending_items = {}
+    for item in grocery_items:
+        item_key = normalized_names[item['Name']]
+        if item_key in shelf_lives:
+            yield set_expiration_date(item, shelf_lives[item_key])
+        else:
+            pending_items.setdefault(item_key, []).append(item)
+    
+    # Skip DeepSeek entirely when every item was cached
+    if not pending_items:
+        return
     
-    # Prepare the list of items for DeepSeek
-    items_list = "\n".join([f"{item['Name']}" for item in grocery_items])
+    # Prepare the list of items for DeepSeek, sending each distinct item once
+    unique_names = sorted(items[0]['Name'] for items in pending_items.values())
+    items_list = "\n".join(unique_names)
     
     # Prepare the prompt for DeepSeek
     prompt = f"""
@@ -102,95 +208,158 @@ def estimate_expiration_dates(grocery_items):
     # Prepare the payload for DeepSeek
     payload = {
         "prompt": prompt,
-        "max_tokens": 1000,
+        "max_tokens": max(1000, TOKENS_PER_ESTIMATE * len(unique_names)),
         "temperature": 0.2
     }
     
-    # Invoke the DeepSeek endpoint
-    response = sagemaker_runtime.invoke_endpoint(
-        EndpointName=DEEPSEEK_ENDPOINT,
-        ContentType='application/json',
-        Body=json.dumps(payload)
-    )
+    # Update the grocery items with the estimated expiration dates
+    new_shelf_lives = {}
+    for name, days in parse_expiration_estimates(invoke_endpoint(payload)).items():
+        item_key = normalize_item_name(name)
+        new_shelf_lives[item_key] = days
+        for item in pending_items.pop(item_key, []):
+            yield set_expiration_date(item, days)
     
-    # Parse the response
-    result = json.loads(response['Body'].read().decode())
+    # Cache the new estimates by normalized name
+    cache_shelf_lives(new_shelf_lives)
     
-    # Extract the expiration estimates from the response
-    if 'generated_text' in result:
-        expiration_text = result['generated_text']
-        expiration_estimates = parse_expiration_estimates(expiration_text)
-        
-        # Update the grocery items with expiration dates
-        for item in grocery_items:
-            item_name = item['Name']
-            if item_name in expiration_estimates:
-                days = expiration_estimates[item_name]
-                purchase_date = datetime.strptime(item['PurchaseDate'], "%Y-%m-%d")
-                expiration_date = purchase_date + timedelta(days=days)
-                
-                # Add expiration date to the item
-                item['ExpirationDate'] = expiration_date.strftime("%Y-%m-%d")
-                item['ShelfLifeDays'] = days
-            else:
-                # Default expiration date (7 days) if not found
-                purchase_date = datetime.strptime(item['PurchaseDate'], "%Y-%m-%d")
-                expiration_date = purchase_date + timedelta(days=7)
-                
-                item['ExpirationDate'] = expiration_date.strftime("%Y-%m-%d")
-                item['ShelfLifeDays'] = 7
-            
-            updated_items.append(item)
+    # Default expiration date (7 days) if not found
+    for items in pending_items.values():
+        for item in items:
+            yield set_expiration_date(item, 7)
+
+def set_expiration_date(item, days):
+    """
+    Add the expiration date for a shelf life of the given number of days to an item.
+    """
+    purchase_date = date.fromisoformat(item['PurchaseDate'])
+    expiration_date = purchase_date + timedelta(days=days)
+    
+    item['ExpirationDate'] = expiration_date.isoformat()
+    item['ShelfLifeDays'] = days
+    
+    return item
+
+def invoke_endpoint(payload):
+    """
+    Invoke the DeepSeek endpoint and return the generated text.
+    """
+    body = json.dumps(payload)
+    
+    if DEEPSEEK_INFERENCE_MODE == 'async':
+        response_body = invoke_endpoint_async(DEEPSEEK_ENDPOINT, body, DEEPSEEK_ASYNC_INPUT_BUCKET)
     else:
-        raise Exception("Failed to estimate expiration dates")
+        response = sagemaker_runtime.invoke_endpoint(
+            EndpointName=DEEPSEEK_ENDPOINT,
+            ContentType='application/json',
+            Body=body
+        )
+        response_body = response['Body'].read()
     
-    return updated_items
+    result = json.loads(response_body)
+    if 'generated_text' not in result:
+        raise Exception("Failed to generate response from DeepSeek endpoint")
+    
+    return result['generated_text']
 
-def parse_expiration_estimates(expiration_text):
+def get_cached_shelf_lives(keys):
     """
-    Parse the expiration estimates from the DeepSeek response.
+    Look up cached shelf lives (in days) for normalized item names.
+    
+    Returns an empty dict when no SHELF_LIFE_CACHE_TABLE is configured or the
+    cache cannot be read, so every item falls through to DeepSeek. Keys still
+    unprocessed after the retries are treated as misses.
     """
-    estimates = {}
+    keys = [key for key in dict.fromkeys(keys) if key]
+    shelf_lives = {}
     
-    # Split the text into lines
-    lines = expiration_text.strip().split('\n')
+    if not SHELF_LIFE_CACHE_TABLE or not keys:
+        return shelf_lives
     
-    for line in lines:
-        # Skip empty lines
-        if not line.strip():
-            continue
-        
-        # Try to extract item name and days
-        parts = line.split(':', 1)
-        if len(parts) == 2:
-            item_name = parts[0].strip()
-            days_text = parts[1].strip()
-            
-            # Extract the number of days
-            import re
-            days_match = re.search(r'(\d+)', days_text)
-            if days_match:
-                days = int(days_match.group(1))
-                estimates[item_name] = days
-    
-    return estimates
+    try:
+        for i in range(0, len(keys), BATCH_GET_LIMIT):
+            request = {
+                SHELF_LIFE_CACHE_TABLE: {
+                    'Keys': [{'NormalizedName': key} for key in keys[i:i + BATCH_GET_LIMIT]]
+                }
+            }
+            for attempt in range(MAX_BATCH_GET_ATTEMPTS):
+                if attempt:
+                    # Back off before resending the keys DynamoDB did not process
+                    time.sleep(min(0.1 * 2 ** attempt + random.random() * 0.1, 5))
+                response = dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(SHELF_LIFE_CACHE_TABLE, []):
+                    shelf_lives[item['NormalizedName']] = int(item['ShelfLifeDays'])
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+    except ClientError as e:
+        print(f"Error reading shelf life cache: {str(e)}")
+    
+    return shelf_lives
+
+def cache_shelf_lives(shelf_lives):
+    """
+    Store new shelf life estimates in the shelf life cache.
+    """
+    if not SHELF_LIFE_CACHE_TABLE or not shelf_lives:
+        return
+    
+    try:
+        table = dynamodb.Table(SHELF_LIFE_CACHE_TABLE)
+        with table.batch_writer(overwrite_by_pkeys=['NormalizedName']) as batch:
+            for key, days in shelf_lives.items():
+                if not key:
+                    continue
+                batch.put_item(Item={'NormalizedName': key, 'ShelfLifeDays': days})
+    except ClientError as e:
+        print(f"Error writing shelf life cache: {str(e)}")
+
+def parse_expiration_estimates(expiration_text):
+    """
+    Parse the expiration estimates from the DeepSeek response.
+    """
+    # One pass over the whole response: the name before the first colon and
+    # the first number after it on the same line
+    return {name: int(days) for name, days in _ESTIMATE_LINE_RE.findall(expiration_text)}
 
 def update_grocery_items(grocery_items):
     """
     Update the grocery items in DynamoDB with expiration dates.
+    
+    The UpdateItem calls are independent, so they are issued concurrently
+    rather than one round trip at a time, starting as soon as each item is
+    produced. Partial updates are kept so that attributes not loaded by
+    get_grocery_items are left untouched.
+    
+    Returns the updated items.
     """
-    table = dynamodb.Table(GROCERY_TABLE)
+    updated_at = datetime.utcnow().isoformat()
+    updated_items = []
     
-    for item in grocery_items:
-        # Update the item in DynamoDB
-        table.update_item(
+    def update_item(item):
+        # Update the item in DynamoDB; throttled calls are retried by the client
+        TABLE.update_item(
             Key={
                 'ItemId': item['ItemId']
             },
-            UpdateExpression="set ExpirationDate = :ed, ShelfLifeDays = :sld, UpdatedAt = :ua",
+            UpdateExpression="set ExpirationDate = :ed, ShelfLifeDays = :sld, ExpiringBucket = :eb, UpdatedAt = :ua",
             ExpressionAttributeValues={
                 ':ed': item['ExpirationDate'],
+                ':eb': EXPIRING_BUCKET,
                 ':sld': item['ShelfLifeDays'],
-                ':ua': datetime.now().isoformat()
+                ':ua': updated_at
             }
         )
+    
+    with ThreadPoolExecutor(max_workers=UPDATE_WORKERS) as executor:
+        futures = []
+        for item in grocery_items:
+            futures.append(executor.submit(update_item, item))
+            updated_items.append(item)
+        
+        # Raise the first failure
+        for future in futures:
+            future.result()
+    
+    return updated_items
@@ -1,14 +1,23 @@
 import json
-import boto3
 import os
-from datetime import datetime
-
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key
+from datetime import date, datetime, timedelta
+from common.aws import DYNAMODB as dynamodb
 
 # Get environment variables
 GROCERY_TABLE = os.environ['GROCERY_TABLE']
 
+# Grocery table handle, created once per container
+TABLE = dynamodb.Table(GROCERY_TABLE)
+
+# Number of parallel scan segments used to read the inventory
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', '4'))
+
+# GSI on GroceryItems partitioned by ExpiringBucket and sorted by ExpirationDate
+EXPIRATION_INDEX = 'Expiration-index'
+EXPIRING_BUCKET = 'active'
+
 def lambda_handler(event, context):
     """
     Lambda function to track grocery inventory.
@@ -87,34 +96,27 @@ def get_grocery_inventory(days_to_expiration=None):
     
     If days_to_expiration is provided, only return items expiring within that many days.
     """
-    table = dynamodb.Table(GROCERY_TABLE)
-    
-    # Get all items from the table
-    response = table.scan()
-    items = response.get('Items', [])
-    
-    # Continue scanning if we have more items (pagination)
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        items.extend(response.get('Items', []))
-    
     # If we need to filter by expiration date
     if days_to_expiration is not None:
         today = datetime.now().date()
+        cutoff = today + timedelta(days=days_to_expiration)
+        
+        # No item expires within a negative window, and the query would
+        # reject its inverted BETWEEN bounds
+        if cutoff < today:
+            return []
+        
+        # Only read items expiring within the window
+        items = query_expiring_items(today.isoformat(), cutoff.isoformat())
         filtered_items = []
         
         for item in items:
-            # Skip items without expiration date
-            if 'ExpirationDate' not in item:
-                continue
-            
             try:
-                expiration_date = datetime.strptime(item['ExpirationDate'], "%Y-%m-%d").date()
-                days_until_expiration = (expiration_date - today).days
+                expiration_date = date.fromisoformat(item['ExpirationDate'])
                 
-                if 0 <= days_until_expiration <= days_to_expiration:
+                if today <= expiration_date <= cutoff:
                     # Add days until expiration to the item
-                    item['DaysUntilExpiration'] = days_until_expiration
+                    item['DaysUntilExpiration'] = (expiration_date - today).days
                     filtered_items.append(item)
             except ValueError:
                 # Skip items with invalid expiration date format
@@ -122,16 +124,61 @@ def get_grocery_inventory(days_to_expiration=None):
         
         return filtered_items
     
+    return scan_inventory()
+
+def query_expiring_items(start_date, end_date):
+    """
+    Query the Expiration-index GSI for items expiring between two ISO dates.
+    """
+    query_kwargs = {
+        'IndexName': EXPIRATION_INDEX,
+        'KeyConditionExpression': (
+            Key('ExpiringBucket').eq(EXPIRING_BUCKET) &
+            Key('ExpirationDate').between(start_date, end_date)
+        )
+    }
+    response = TABLE.query(**query_kwargs)
+    items = response.get('Items', [])
+    
+    # Handle pagination
+    while 'LastEvaluatedKey' in response:
+        response = TABLE.query(ExclusiveStartKey=response['LastEvaluatedKey'], **query_kwargs)
+        items.extend(response.get('Items', []))
+    
+    return items
+
+def scan_inventory():
+    """
+    Read every grocery item, scanning the table segments in parallel.
+    """
+    def scan_segment(segment):
+        response = TABLE.scan(TotalSegments=SCAN_SEGMENTS, Segment=segment)
+        items = response.get('Items', [])
+        
+        # Continue scanning if we have more items (pagination)
+        while 'LastEvaluatedKey' in response:
+            response = TABLE.scan(
+                TotalSegments=SCAN_SEGMENTS,
+                Segment=segment,
+                ExclusiveStartKey=response['LastEvaluatedKey']
+            )
+            items.extend(response.get('Items', []))
+        
+        return items
+    
+    items = []
+    with ThreadPoolExecutor(max_workers=SCAN_SEGMENTS) as executor:
+        for segment_items in executor.map(scan_segment, range(SCAN_SEGMENTS)):
+            items.extend(segment_items)
+    
     return items
 
 def remove_grocery_item(item_id):
     """
     Remove a grocery item from DynamoDB (mark as consumed).
     """
-    table = dynamodb.Table(GROCERY_TABLE)
-    
     # Delete the item from DynamoDB
-    table.delete_item(
+    TABLE.delete_item(
         Key={
             'ItemId': item_id
         }
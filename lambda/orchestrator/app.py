@@ -1,17 +1,23 @@
 import json
-import boto3
 import os
 import uuid
 from datetime import datetime
+from common.aws import LAMBDA as lambda_client, SQS as sqs
 
-# Initialize AWS clients
-lambda_client = boto3.client('lambda')
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from json import dumps as json_dumps, loads as json_loads
 
 # Get environment variables
 RECEIPT_INTERPRETER_FUNCTION = os.environ['RECEIPT_INTERPRETER_FUNCTION']
 EXPIRATION_DATE_ESTIMATOR_FUNCTION = os.environ['EXPIRATION_DATE_ESTIMATOR_FUNCTION']
 GROCERY_TRACKER_FUNCTION = os.environ['GROCERY_TRACKER_FUNCTION']
 RECIPE_RECOMMENDER_FUNCTION = os.environ['RECIPE_RECOMMENDER_FUNCTION']
+EXPIRATION_QUEUE_URL = os.environ.get('EXPIRATION_QUEUE_URL')
+
+# Event source that asks downstream functions to return an unserialized body
+ORCHESTRATOR_SOURCE = 'orchestrator'
 
 def lambda_handler(event, context):
     """
@@ -58,33 +64,50 @@ def process_receipt(event):
     Process a receipt upload and coordinate the workflow.
     
     1. Call receipt_interpreter to extract items from receipt
-    2. Call expiration_date_estimator to estimate expiration dates
-    3. Return the processed items
+    2. Queue the receipt for expiration date estimation
+    3. Return the extracted items with a 202 status
+    
+    The estimator's DeepSeek call is the slow step, so the orchestrator does not
+    wait for it. Receipts are queued in SQS so the estimator can handle several
+    receipts with one DeepSeek call; without a queue the estimator is invoked
+    asynchronously. Expiration dates appear in the grocery inventory once it finishes.
     """
-    # Step 1: Call receipt_interpreter
-    receipt_response = invoke_lambda(RECEIPT_INTERPRETER_FUNCTION, event)
+    # Step 1: Call receipt_interpreter, which returns its body as a dict
+    # rather than a JSON string when called directly by the orchestrator
+    receipt_event = dict(event, source=ORCHESTRATOR_SOURCE)
+    receipt_response = invoke_lambda(RECEIPT_INTERPRETER_FUNCTION, receipt_event)
     
     if receipt_response.get('statusCode') != 200:
         return receipt_response
     
-    # Parse the receipt response
-    receipt_body = json.loads(receipt_response['body'])
+    receipt_body = receipt_response['body']
     receipt_id = receipt_body.get('receipt_id')
     
-    # Step 2: Call expiration_date_estimator
-    expiration_event = {
+    # Step 2: Start expiration date estimation without waiting for the result
+    if EXPIRATION_QUEUE_URL:
+        sqs.send_message(
+            QueueUrl=EXPIRATION_QUEUE_URL,
+            MessageBody=json.dumps({'receipt_id': receipt_id})
+        )
+    else:
+        expiration_event = {
+            'body': {
+                'receipt_id': receipt_id
+            }
+        }
+        
+        invoke_lambda_async(EXPIRATION_DATE_ESTIMATOR_FUNCTION, expiration_event)
+    
+    # Return the extracted items while expiration dates are estimated
+    return {
+        'statusCode': 202,
         'body': json.dumps({
-            'receipt_id': receipt_id
+            'message': 'Receipt processed, estimating expiration dates',
+            'receipt_id': receipt_id,
+            'items_count': receipt_body.get('items_count'),
+            'items': receipt_body.get('items')
         })
     }
-    
-    expiration_response = invoke_lambda(EXPIRATION_DATE_ESTIMATOR_FUNCTION, expiration_event)
-    
-    if expiration_response.get('statusCode') != 200:
-        return expiration_response
-    
-    # Return the final response
-    return expiration_response
 
 def get_grocery_inventory(event):
     """
@@ -109,10 +132,20 @@ def invoke_lambda(function_name, event):
     response = lambda_client.invoke(
         FunctionName=function_name,
         InvocationType='RequestResponse',
-        Payload=json.dumps(event)
+        Payload=json_dumps(event)
     )
     
     # Parse the response
-    payload = json.loads(response['Payload'].read().decode())
+    payload = json_loads(response['Payload'].read())
     
     return payload
+
+def invoke_lambda_async(function_name, event):
+    """
+    Invoke a Lambda function asynchronously without waiting for its response.
+    """
+    lambda_client.invoke(
+        FunctionName=function_name,
+        InvocationType='Event',
+        Payload=json_dumps(event)
+    )
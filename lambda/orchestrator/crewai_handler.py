@@ -1,16 +1,28 @@
 import json
+import base64
 import os
+import uuid
+from datetime import datetime
+from common.aws import DYNAMODB as dynamodb, S3 as s3, SQS as sqs
 from common.grocery_crew import GroceryManagementCrew
 
+# Get environment variables
+RECEIPT_BUCKET = os.environ['RECEIPT_BUCKET']
+RECEIPT_QUEUE_URL = os.environ['RECEIPT_QUEUE_URL']
+RECEIPT_JOBS_TABLE = os.environ['RECEIPT_JOBS_TABLE']
+
 def lambda_handler(event, context):
     """
-    Lambda function to orchestrate the grocery management workflow using CrewAI.
+    Lambda function to accept grocery management workflow requests.
     
     This function:
     1. Processes incoming API Gateway requests
-    2. Initializes the GroceryManagementCrew
-    3. Executes the appropriate workflow
-    4. Returns the results to the client
+    2. Queues receipt uploads for the CrewAI worker and returns 202 with a request_id
+    3. Returns the status and result of a queued request
+    
+    The worker (worker_handler) runs with a reserved concurrency matched to the
+    DeepSeek endpoint capacity, so bursts of uploads wait in SQS instead of
+    overloading the endpoint.
     """
     try:
         # Parse the incoming event
@@ -19,28 +31,13 @@ def lambda_handler(event, context):
         
         # Process receipt upload
         if path.endswith('/receipts') and http_method == 'POST':
-            # Parse the body
-            body = json.loads(event['body']) if isinstance(event.get('body'), str) else event.get('body', {})
-            
-            # Get the receipt image data
-            if 'image' not in body:
-                return {
-                    'statusCode': 400,
-                    'body': json.dumps({'error': 'No image provided'})
-                }
-            
-            receipt_image_base64 = body['image']
-            
-            # Initialize the crew
-            crew = GroceryManagementCrew()
-            
-            # Process the receipt
-            result = crew.process_receipt(receipt_image_base64)
-            
-            return {
-                'statusCode': 200,
-                'body': json.dumps(result)
-            }
+            return receive_receipt(event)
+        
+        # Get the status of a queued receipt
+        elif '/receipts/' in path and http_method == 'GET':
+            path_parameters = event.get('pathParameters') or {}
+            request_id = path_parameters.get('request_id') or path.rsplit('/', 1)[-1]
+            return get_receipt_status(request_id)
         
         # Handle unknown requests
         else:
@@ -55,3 +52,123 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
+
+def receive_receipt(event):
+    """
+    Queue a receipt upload for processing by the CrewAI worker.
+    
+    The image is staged in S3 because receipt images can exceed the SQS
+    message size limit.
+    """
+    # Parse the body
+    body = json.loads(event['body']) if isinstance(event.get('body'), str) else event.get('body', {})
+    
+    # Get the receipt image data
+    if 'image' not in body:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': 'No image provided'})
+        }
+    
+    request_id = str(uuid.uuid4())
+    image_key = f"pending/{request_id}.jpg"
+    
+    # Stage the image for the worker
+    s3.put_object(
+        Bucket=RECEIPT_BUCKET,
+        Key=image_key,
+        Body=base64.b64decode(body['image']),
+        ContentType='image/jpeg'
+    )
+    
+    # Record the pending request
+    dynamodb.Table(RECEIPT_JOBS_TABLE).put_item(Item={
+        'RequestId': request_id,
+        'Status': 'PENDING',
+        'CreatedAt': datetime.now().isoformat()
+    })
+    
+    # Queue the request for the worker
+    sqs.send_message(
+        QueueUrl=RECEIPT_QUEUE_URL,
+        MessageBody=json.dumps({
+            'request_id': request_id,
+            'image_key': image_key
+        })
+    )
+    
+    return {
+        'statusCode': 202,
+        'body': json.dumps({
+            'message': 'Receipt queued for processing',
+            'request_id': request_id
+        })
+    }
+
+def get_receipt_status(request_id):
+    """
+    Return the status, and the result once available, of a queued receipt.
+    """
+    response = dynamodb.Table(RECEIPT_JOBS_TABLE).get_item(Key={'RequestId': request_id})
+    job = response.get('Item')
+    
+    if not job:
+        return {
+            'statusCode': 404,
+            'body': json.dumps({'error': f'No request found for request_id: {request_id}'})
+        }
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'request_id': request_id,
+            'status': job['Status'],
+            'result': json.loads(job['Result']) if 'Result' in job else None,
+            'error': job.get('Error')
+        })
+    }
+
+def worker_handler(event, context):
+    """
+    SQS-triggered Lambda function that runs the CrewAI workflow for queued receipts.
+    
+    This function:
+    1. Reads the staged receipt image for each queued request
+    2. Runs the GroceryManagementCrew workflow
+    3. Stores the result (or error) in DynamoDB keyed by request_id
+    4. Deletes the staged receipt image
+    """
+    table = dynamodb.Table(RECEIPT_JOBS_TABLE)
+    
+    for record in event.get('Records', []):
+        message = json.loads(record['body'])
+        request_id = message['request_id']
+        
+        try:
+            # Get the staged receipt image
+            image_object = s3.get_object(Bucket=RECEIPT_BUCKET, Key=message['image_key'])
+            receipt_image_base64 = base64.b64encode(image_object['Body'].read()).decode('utf-8')
+            
+            # Initialize the crew and process the receipt
+            crew = GroceryManagementCrew()
+            result = crew.process_receipt(receipt_image_base64)
+            
+            table.put_item(Item={
+                'RequestId': request_id,
+                'Status': 'COMPLETED',
+                'Result': json.dumps(result, default=str),
+                'UpdatedAt': datetime.now().isoformat()
+            })
+        
+        except Exception as e:
+            print(f"Error processing request {request_id}: {str(e)}")
+            table.put_item(Item={
+                'RequestId': request_id,
+                'Status': 'FAILED',
+                'Error': str(e),
+                'UpdatedAt': datetime.now().isoformat()
+            })
+        
+        finally:
+            # The job is finished either way, so the staged image is no longer needed
+            s3.delete_object(Bucket=RECEIPT_BUCKET, Key=message['image_key'])
@@ -1,19 +1,47 @@
 import json
-import boto3
 import base64
+import hashlib
+import io
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from common.async_inference import invoke_endpoint_async
+from common.aws import DYNAMODB as dynamodb, S3 as s3, SM_RUNTIME as sagemaker_runtime
 
-# Initialize AWS clients
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-sagemaker_runtime = boto3.client('sagemaker-runtime')
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    from PIL import ExifTags, Image, ImageOps
+except ImportError:
+    Image = None
 
 # Get environment variables
 RECEIPT_BUCKET = os.environ['RECEIPT_BUCKET']
 GROCERY_TABLE = os.environ['GROCERY_TABLE']
 DEEPSEEK_ENDPOINT = os.environ['DEEPSEEK_ENDPOINT']
+PROCESSED_RECEIPTS_TABLE = os.environ.get('PROCESSED_RECEIPTS_TABLE')
+DEEPSEEK_INFERENCE_MODE = os.environ.get('DEEPSEEK_INFERENCE_MODE', 'realtime')
+DEEPSEEK_ASYNC_INPUT_BUCKET = os.environ.get('DEEPSEEK_ASYNC_INPUT_BUCKET')
+
+# Receipt images are downscaled to this longest side and re-encoded as JPEG
+MAX_IMAGE_DIMENSION = 1600
+JPEG_QUALITY = 80
+
+# Results of processed receipt images are kept for a week, so an upload that
+# is retried or repeated within that window is not extracted again
+PROCESSED_RECEIPT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Event source of direct calls from the orchestrator, which take the response
+# body as a dict instead of a JSON string
+ORCHESTRATOR_SOURCE = 'orchestrator'
+
+# Grocery table handle, created once per container
+TABLE = dynamodb.Table(GROCERY_TABLE)
 
 def lambda_handler(event, context):
     """
@@ -28,7 +56,7 @@ def lambda_handler(event, context):
     """
     try:
         # Parse the incoming event
-        body = json.loads(event['body']) if isinstance(event.get('body'), str) else event.get('body', {})
+        body = json_loads(event['body']) if isinstance(event.get('body'), str) else event.get('body', {})
         
         # Get the base64 encoded image
         if 'image' not in body:
@@ -40,39 +68,54 @@ def lambda_handler(event, context):
         image_data = body['image']
         image_content = base64.b64decode(image_data)
         
-        # Generate a unique filename
-        receipt_id = str(uuid.uuid4())
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        filename = f"{receipt_id}-{timestamp}.jpg"
+        # Return the earlier result if this exact image was already processed
+        content_hash = hashlib.sha256(image_content).hexdigest()
+        processed_receipt = get_processed_receipt(content_hash)
+        if processed_receipt:
+            return build_response(event, processed_receipt)
         
-        # Upload the image to S3
-        s3.put_object(
-            Bucket=RECEIPT_BUCKET,
-            Key=filename,
-            Body=image_content,
-            ContentType='image/jpeg'
-        )
+        # Shrink the image before it is uploaded and sent to DeepSeek
+        compressed_content = compress_image(image_content)
+        if compressed_content is not image_content:
+            image_content = compressed_content
+            image_data = base64.b64encode(image_content).decode('utf-8')
         
-        # Get the S3 URL
-        s3_url = f"s3://{RECEIPT_BUCKET}/{filename}"
+        # Generate a unique receipt ID and name the image by its content hash,
+        # so re-uploads of the same image overwrite the same object
+        receipt_id = str(uuid.uuid4())
+        filename = f"{content_hash}.jpg"
         
-        # Extract text from the receipt using DeepSeek AI
-        receipt_text = extract_text_from_receipt(image_content)
+        # Upload the image to S3 while DeepSeek extracts text from the receipt.
+        # DeepSeek receives the image inline, so the two calls are independent.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            upload_future = executor.submit(
+                s3.put_object,
+                Bucket=RECEIPT_BUCKET,
+                Key=filename,
+                Body=image_content,
+                ContentType='image/jpeg'
+            )
+            text_future = executor.submit(extract_text_from_receipt, image_data)
+            
+            receipt_text = text_future.result()
+            
+            # Parse the receipt text to identify grocery items and store them in DynamoDB
+            grocery_items = store_grocery_items(receipt_id, parse_receipt_text(receipt_text))
+            
+            upload_future.result()
         
-        # Parse the receipt text to identify grocery items
-        grocery_items = parse_receipt_text(receipt_text)
+        result = {
+            'receipt_id': receipt_id,
+            'items_count': len(grocery_items),
+            'items': grocery_items
+        }
         
-        # Store the items in DynamoDB
-        store_grocery_items(receipt_id, grocery_items)
+        # Remember the result for duplicate uploads of this image, unless no
+        # items were found, so that uploading it again retries the extraction
+        if grocery_items:
+            store_processed_receipt(content_hash, result)
         
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'receipt_id': receipt_id,
-                'items_count': len(grocery_items),
-                'items': grocery_items
-            })
-        }
+        return build_response(event, result)
     
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -81,9 +124,53 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
-def extract_text_from_receipt(image_content):
+def compress_image(image_content):
+    """
+    Downscale and re-encode a receipt image as JPEG to reduce its size.
+    
+    The EXIF orientation is applied to the pixels before re-encoding, since the
+    JPEG written here carries no EXIF data.
+    
+    Returns the original bytes when Pillow is not installed, the image cannot be
+    decoded, or re-encoding an upright image does not make it smaller.
+    """
+    if Image is None:
+        return image_content
+    
+    try:
+        with Image.open(io.BytesIO(image_content)) as image:
+            # Phone photos are often stored sideways with an Orientation tag
+            rotated = image.getexif().get(ExifTags.Base.Orientation, 1) != 1
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+            
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    except (OSError, ValueError) as e:
+        print(f"Error compressing receipt image: {str(e)}")
+        return image_content
+    
+    # Keep a rotated image even if it did not shrink, so it is stored upright
+    compressed_content = buffer.getvalue()
+    if rotated or len(compressed_content) < len(image_content):
+        return compressed_content
+    return image_content
+
+def build_response(event, result):
+    """
+    Build a successful response, leaving the body unserialized for the orchestrator.
+    """
+    return {
+        'statusCode': 200,
+        'body': result if event.get('source') == ORCHESTRATOR_SOURCE else json.dumps(result)
+    }
+
+def extract_text_from_receipt(image_base64):
     """
     Use DeepSeek AI to extract text from the receipt image.
+    
+    The image is passed as the base64 string received from the client, so it is
+    not re-encoded after being decoded for the S3 upload.
     """
     # Prepare the prompt for DeepSeek
     prompt = """
@@ -95,26 +182,35 @@ def extract_text_from_receipt(image_content):
     # Prepare the payload for DeepSeek
     payload = {
         "prompt": prompt,
-        "image_base64": base64.b64encode(image_content).decode('utf-8'),
+        "image_base64": image_base64,
         "max_tokens": 1000,
         "temperature": 0.2
     }
     
     # Invoke the DeepSeek endpoint
-    response = sagemaker_runtime.invoke_endpoint(
-        EndpointName=DEEPSEEK_ENDPOINT,
-        ContentType='application/json',
-        Body=json.dumps(payload)
-    )
-    
-    # Parse the response
-    result = json.loads(response['Body'].read().decode())
-    
-    # Extract the text from the response
-    if 'generated_text' in result:
-        return result['generated_text']
+    return invoke_endpoint(payload)
+
+def invoke_endpoint(payload):
+    """
+    Invoke the DeepSeek endpoint and return the generated text.
+    """
+    body = json.dumps(payload)
+    
+    if DEEPSEEK_INFERENCE_MODE == 'async':
+        response_body = invoke_endpoint_async(DEEPSEEK_ENDPOINT, body, DEEPSEEK_ASYNC_INPUT_BUCKET)
     else:
-        raise Exception("Failed to extract text from receipt")
+        response = sagemaker_runtime.invoke_endpoint(
+            EndpointName=DEEPSEEK_ENDPOINT,
+            ContentType='application/json',
+            Body=body
+        )
+        response_body = response['Body'].read()
+    
+    result = json_loads(response_body)
+    if 'generated_text' not in result:
+        raise Exception("Failed to generate response from DeepSeek endpoint")
+    
+    return result['generated_text']
 
 def parse_receipt_text(receipt_text):
     """
@@ -123,13 +219,13 @@ def parse_receipt_text(receipt_text):
     This is a simplified implementation. In a real-world scenario,
     you would use more sophisticated NLP techniques or DeepSeek AI
     to accurately parse the receipt text.
-    """
-    grocery_items = []
     
-    # Split the text into lines
-    lines = receipt_text.strip().split('\n')
+    Items are yielded one at a time, so they can be queued for DynamoDB as
+    they are parsed.
+    """
+    purchase_date = datetime.utcnow().strftime("%Y-%m-%d")
     
-    for line in lines:
+    for line in receipt_text.strip().split('\n'):
         # Skip empty lines
         if not line.strip():
             continue
@@ -147,35 +243,76 @@ def parse_receipt_text(receipt_text):
                 grocery_item = {
                     'name': item_name,
                     'price': price,
-                    'purchase_date': datetime.now().strftime("%Y-%m-%d")
+                    'purchase_date': purchase_date
                 }
                 
-                grocery_items.append(grocery_item)
+                yield grocery_item
             except ValueError:
                 # Skip lines where price cannot be parsed
                 continue
-    
-    return grocery_items
 
 def store_grocery_items(receipt_id, grocery_items):
     """
     Store the grocery items in DynamoDB.
+    
+    Returns the stored items.
     """
-    table = dynamodb.Table(GROCERY_TABLE)
+    created_at = datetime.utcnow().isoformat()
+    stored_items = []
     
-    for i, item in enumerate(grocery_items):
-        # Generate a unique ID for each item
-        item_id = f"{receipt_id}-{i+1}"
-        
-        # Prepare the item for DynamoDB
-        db_item = {
-            'ItemId': item_id,
-            'ReceiptId': receipt_id,
-            'Name': item['name'],
-            'Price': item['price'],
-            'PurchaseDate': item['purchase_date'],
-            'CreatedAt': datetime.now().isoformat()
-        }
-        
-        # Put the item in DynamoDB
-        table.put_item(Item=db_item)
+    # batch_writer groups puts into 25-item BatchWriteItem calls and
+    # resends any unprocessed items
+    with TABLE.batch_writer(overwrite_by_pkeys=['ItemId']) as batch:
+        for i, item in enumerate(grocery_items):
+            # Generate a unique ID for each item
+            item_id = f"{receipt_id}-{i+1}"
+            
+            # Prepare the item for DynamoDB
+            db_item = {
+                'ItemId': item_id,
+                'ReceiptId': receipt_id,
+                'Name': item['name'],
+                'Price': item['price'],
+                'PurchaseDate': item['purchase_date'],
+                'CreatedAt': created_at
+            }
+            
+            # Queue the item for the next batch
+            batch.put_item(Item=db_item)
+            stored_items.append(item)
+    
+    return stored_items
+
+def get_processed_receipt(content_hash):
+    """
+    Look up the result of an earlier upload of the same receipt image.
+    
+    Returns None when no PROCESSED_RECEIPTS_TABLE is configured or the image
+    has not been processed recently.
+    """
+    if not PROCESSED_RECEIPTS_TABLE:
+        return None
+    
+    response = dynamodb.Table(PROCESSED_RECEIPTS_TABLE).get_item(Key={'ContentHash': content_hash})
+    item = response.get('Item')
+    
+    # DynamoDB TTL deletion is lazy, so expired items may still be returned
+    if not item or int(item.get('ExpiresAt', 0)) <= time.time():
+        return None
+    
+    return json.loads(item['Result'])
+
+def store_processed_receipt(content_hash, result):
+    """
+    Record the result of processing a receipt image, keyed by its content hash.
+    """
+    if not PROCESSED_RECEIPTS_TABLE:
+        return
+    
+    dynamodb.Table(PROCESSED_RECEIPTS_TABLE).put_item(Item={
+        'ContentHash': content_hash,
+        'ReceiptId': result['receipt_id'],
+        'Result': json.dumps(result),
+        'CreatedAt': datetime.utcnow().isoformat(),
+        'ExpiresAt': int(time.time()) + PROCESSED_RECEIPT_TTL_SECONDS
+    })
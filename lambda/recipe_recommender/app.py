@@ -1,16 +1,100 @@
+import hashlib
 import json
-import boto3
+from botocore.exceptions import ClientError
 import os
-from datetime import datetime
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeDeserializer
+from datetime import date, datetime, timedelta
+from common.async_inference import invoke_endpoint_async
+from common.aws import DYNAMODB as dynamodb, DYNAMODB_CLIENT as dynamodb_client, SM_RUNTIME as sagemaker_runtime
 
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-sagemaker_runtime = boto3.client('sagemaker-runtime')
+try:
+    from orjson import dumps as orjson_dumps
+    
+    def json_dumps(obj):
+        return orjson_dumps(obj).decode('utf-8')
+except ImportError:
+    from json import dumps as json_dumps
 
 # Get environment variables
 GROCERY_TABLE = os.environ['GROCERY_TABLE']
 RECIPE_TABLE = os.environ['RECIPE_TABLE']
 DEEPSEEK_ENDPOINT = os.environ['DEEPSEEK_ENDPOINT']
+RECIPE_CACHE_TABLE = os.environ.get('RECIPE_CACHE_TABLE')
+DEEPSEEK_INFERENCE_MODE = os.environ.get('DEEPSEEK_INFERENCE_MODE', 'realtime')
+DEEPSEEK_ASYNC_INPUT_BUCKET = os.environ.get('DEEPSEEK_ASYNC_INPUT_BUCKET')
+
+# Table handles, created once per container
+RECIPE = dynamodb.Table(RECIPE_TABLE)
+RECIPE_CACHE = dynamodb.Table(RECIPE_CACHE_TABLE) if RECIPE_CACHE_TABLE else None
+
+# Converts low-level DynamoDB attribute values to Python values
+_DESERIALIZE = TypeDeserializer().deserialize
+
+# Number of parallel scan segments used to read the inventory
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', '4'))
+
+# Recipe prompt. The static instructions come first and only the ingredient
+# list at the end changes.
+RECIPE_PROMPT_PREFIX = """
+    You are a creative chef who specializes in creating recipes from available ingredients.
+    Please suggest 3 recipes that can be made using some or all of the ingredients listed at the end.
+    
+    For each recipe, provide:
+    1. Recipe name
+    2. Ingredients needed (indicate which ones are from the provided list)
+    3. Brief cooking instructions
+    4. Approximate cooking time
+    
+    Format your response as JSON with the following structure:
+    {
+        "recipes": [
+            {
+                "name": "Recipe Name",
+                "ingredients": ["Ingredient 1", "Ingredient 2", ...],
+                "instructions": "Brief cooking instructions",
+                "cooking_time_minutes": 30
+            },
+            ...
+        ]
+    }
+    
+    Ingredients: """
+
+# The DeepSeek request body is built around the ingredient list from JSON
+# fragments, so the static instructions are JSON-escaped once per container
+# rather than on every request
+_RECIPE_BODY_PREFIX = '{"prompt": ' + json_dumps(RECIPE_PROMPT_PREFIX)[:-1]
+_RECIPE_BODY_SUFFIX = ', "max_tokens": 2000, "temperature": 0.7}'
+
+# Maximum number of inventory items included in the recipe prompt
+RECIPE_MAX_ITEMS = 30
+
+# Sorts after every ISO date, for items without an expiration date
+NO_EXPIRATION = '9999-12-31'
+
+# Recipes by sorted, joined inventory item names, kept in memory for the
+# lifetime of the container and in RECIPE_CACHE_TABLE for a day
+RECIPE_CACHE_SIZE = 256
+RECIPE_CACHE_TTL_SECONDS = 24 * 60 * 60
+_RECIPE_CACHE = OrderedDict()
+
+# Whether this container has already made a request to the DeepSeek endpoint
+_endpoint_warm = False
+
+# Decoder for the JSON object embedded in the DeepSeek response
+_JSON_DECODER = json.JSONDecoder()
+
+# Patterns used to parse recipes when the response is not valid JSON
+_SECTION_RE = re.compile(r'\d+\.')
+_NAME_RE = re.compile(r'(?:Recipe name:|Name:)?\s*([^\n]+)')
+_INGREDIENTS_RE = re.compile(r'(?:Ingredients:|Ingredients needed:)([^#]*?)(?:Instructions:|Brief cooking instructions:|$)', re.DOTALL)
+_INSTRUCTIONS_RE = re.compile(r'(?:Instructions:|Brief cooking instructions:)([^#]*?)(?:Cooking time:|Approximate cooking time:|$)', re.DOTALL)
+_TIME_RE = re.compile(r'(?:Cooking time:|Approximate cooking time:)\s*(\d+)')
+_SPLIT_RE = re.compile(r'[\n,]')
 
 def lambda_handler(event, context):
     """
@@ -39,8 +123,12 @@ def lambda_handler(event, context):
                 except ValueError:
                     days_to_expiration = 3  # Default to 3 days
             
-            # Get the grocery inventory
-            inventory = get_grocery_inventory(days_to_expiration if use_expiring else None)
+            # Get the grocery inventory, starting a serverless DeepSeek
+            # endpoint in parallel on a new container
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                if not _endpoint_warm and DEEPSEEK_INFERENCE_MODE == 'serverless':
+                    executor.submit(warm_endpoint)
+                inventory = get_grocery_inventory(days_to_expiration if use_expiring else None)
             
             if not inventory:
                 return {
@@ -56,7 +144,7 @@ def lambda_handler(event, context):
             
             return {
                 'statusCode': 200,
-                'body': json.dumps({
+                'body': json_dumps({
                     'recipes_count': len(recipes),
                     'recipes': recipes
                 })
@@ -75,44 +163,102 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
+def warm_endpoint():
+    """
+    Send a one-token request to a serverless DeepSeek endpoint.
+    
+    This starts a cold serverless instance while the inventory is being
+    scanned, so the recipe request does not wait for it afterwards. Realtime
+    endpoints have instances running already and are not worth a model
+    invocation, and asynchronous endpoints do not accept InvokeEndpoint
+    requests.
+    """
+    global _endpoint_warm
+    
+    try:
+        sagemaker_runtime.invoke_endpoint(
+            EndpointName=DEEPSEEK_ENDPOINT,
+            ContentType='application/json',
+            Body=json_dumps({"prompt": "Hi", "max_tokens": 1, "temperature": 0})
+        )
+        _endpoint_warm = True
+    except ClientError as e:
+        print(f"Error warming DeepSeek endpoint: {str(e)}")
+
 def get_grocery_inventory(days_to_expiration=None):
     """
     Retrieve the current grocery inventory from DynamoDB.
     
     If days_to_expiration is provided, only return items expiring within that many days.
     """
-    table = dynamodb.Table(GROCERY_TABLE)
+    # Only the attributes used to build recipes and filter by expiration date.
+    # The low-level client is used so that only these attributes are converted.
+    scan_kwargs = {
+        'TableName': GROCERY_TABLE,
+        'ProjectionExpression': '#n, ExpirationDate',
+        'ExpressionAttributeNames': {'#n': 'Name'}
+    }
     
-    # Get all items from the table
-    response = table.scan()
-    items = response.get('Items', [])
+    # No item expires within a negative window, and DynamoDB would reject the
+    # inverted BETWEEN bounds
+    if days_to_expiration is not None and days_to_expiration < 0:
+        return []
     
-    # Continue scanning if we have more items (pagination)
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        items.extend(response.get('Items', []))
+    # Filter by expiration date in DynamoDB; ISO dates compare correctly as strings
+    if days_to_expiration is not None:
+        today = date.today()
+        today_str = today.isoformat()
+        cutoff_str = (today + timedelta(days=days_to_expiration)).isoformat()
+        scan_kwargs['FilterExpression'] = 'ExpirationDate BETWEEN :today AND :cutoff'
+        scan_kwargs['ExpressionAttributeValues'] = {
+            ':today': {'S': today_str},
+            ':cutoff': {'S': cutoff_str}
+        }
     
-    # If we need to filter by expiration date
+    def scan_segment(segment):
+        # The paginator follows LastEvaluatedKey
+        pages = dynamodb_client.get_paginator('scan').paginate(
+            TotalSegments=SCAN_SEGMENTS,
+            Segment=segment,
+            **scan_kwargs
+        )
+        
+        deserialize = _DESERIALIZE
+        return [
+            {name: deserialize(value) for name, value in item.items()}
+            for page in pages
+            for item in page.get('Items', [])
+        ]
+    
+    # Scan the table segments in parallel
+    items = []
+    with ThreadPoolExecutor(max_workers=SCAN_SEGMENTS) as executor:
+        for segment_items in executor.map(scan_segment, range(SCAN_SEGMENTS)):
+            items.extend(segment_items)
+    
+    # Add days until expiration to the already filtered items
     if days_to_expiration is not None:
-        today = datetime.now().date()
         filtered_items = []
         
+        # Local aliases avoid attribute lookups on every iteration
+        fromisoformat = date.fromisoformat
+        append = filtered_items.append
+        
         for item in items:
-            # Skip items without expiration date
-            if 'ExpirationDate' not in item:
+            # Cheap string check before parsing, in case the filter let
+            # anything outside the range through
+            expiration = item.get('ExpirationDate')
+            if not expiration or expiration < today_str or expiration > cutoff_str:
                 continue
             
             try:
-                expiration_date = datetime.strptime(item['ExpirationDate'], "%Y-%m-%d").date()
-                days_until_expiration = (expiration_date - today).days
-                
-                if 0 <= days_until_expiration <= days_to_expiration:
-                    # Add days until expiration to the item
-                    item['DaysUntilExpiration'] = days_until_expiration
-                    filtered_items.append(item)
+                expiration_date = fromisoformat(expiration)
             except ValueError:
                 # Skip items with invalid expiration date format
                 continue
+            
+            item['DaysUntilExpiration'] = (expiration_date - today).days
+            append(item)
         
         return filtered_items
     
@@ -121,73 +267,142 @@ def get_grocery_inventory(days_to_expiration=None):
 def generate_recipe_recommendations(inventory):
     """
     Use DeepSeek AI to generate recipe recommendations based on available grocery items.
+    
+    Recipes for an inventory with the same item names are served from the
+    recipe cache.
     """
-    # Extract item names from inventory
-    item_names = [item['Name'] for item in inventory]
-    items_list = ", ".join(item_names)
+    # Keep the prompt within a fixed budget: the distinct items expiring soonest
+    # (items without an expiration date last), listed alphabetically. The
+    # joined list also serves as the cache key.
+    ranked_items = sorted(inventory, key=lambda item: (item.get('ExpirationDate', NO_EXPIRATION), item['Name']))
+    item_names = list(dict.fromkeys(item['Name'] for item in ranked_items))[:RECIPE_MAX_ITEMS]
+    items_list = ", ".join(sorted(item_names))
     
-    # Prepare the prompt for DeepSeek
-    prompt = f"""
-    You are a creative chef who specializes in creating recipes from available ingredients.
-    Please suggest 3 recipes that can be made using some or all of the following ingredients:
+    # Serve repeated inventories from the cache
+    cached_recipes = get_cached_recipes(items_list)
+    if cached_recipes is not None:
+        return [dict(recipe) for recipe in cached_recipes]
     
-    {items_list}
+    recipes = request_recipes(items_list)
     
-    For each recipe, provide:
-    1. Recipe name
-    2. Ingredients needed (indicate which ones are from the provided list)
-    3. Brief cooking instructions
-    4. Approximate cooking time
+    # Don't remember a response no recipe could be parsed from
+    if recipes:
+        cache_recipes(items_list, [dict(recipe) for recipe in recipes])
     
-    Format your response as JSON with the following structure:
-    {{
-        "recipes": [
-            {{
-                "name": "Recipe Name",
-                "ingredients": ["Ingredient 1", "Ingredient 2", ...],
-                "instructions": "Brief cooking instructions",
-                "cooking_time_minutes": 30
-            }},
-            ...
-        ]
-    }}
+    return recipes
+
+def get_cached_recipes(items_list):
     """
+    Look up the recipes generated earlier for the same ingredient list.
     
-    # Prepare the payload for DeepSeek
-    payload = {
-        "prompt": prompt,
-        "max_tokens": 2000,
-        "temperature": 0.7
-    }
+    The in-memory cache is checked first, then the RECIPE_CACHE_TABLE DynamoDB
+    table when one is configured. Returns None on a miss.
+    """
+    recipes = _RECIPE_CACHE.get(items_list)
+    if recipes is not None:
+        _RECIPE_CACHE.move_to_end(items_list)
+        return recipes
     
-    # Invoke the DeepSeek endpoint
-    response = sagemaker_runtime.invoke_endpoint(
-        EndpointName=DEEPSEEK_ENDPOINT,
-        ContentType='application/json',
-        Body=json.dumps(payload)
-    )
+    if not RECIPE_CACHE_TABLE:
+        return None
     
-    # Parse the response
-    result = json.loads(response['Body'].read().decode())
+    try:
+        item = RECIPE_CACHE.get_item(Key={'CacheKey': recipe_cache_key(items_list)}).get('Item')
+    except ClientError as e:
+        print(f"Error reading recipe cache: {str(e)}")
+        return None
     
-    # Extract the recipes from the response
-    if 'generated_text' in result:
-        recipes_text = result['generated_text']
-        
-        # Extract JSON from the text
-        import re
-        json_match = re.search(r'({.*})', recipes_text, re.DOTALL)
-        if json_match:
-            try:
-                recipes_json = json.loads(json_match.group(1))
-                return recipes_json.get('recipes', [])
-            except json.JSONDecodeError:
-                # If JSON parsing fails, try to extract recipes manually
-                return parse_recipes_manually(recipes_text)
-        else:
+    # DynamoDB TTL deletion is lazy, so expired items may still be returned
+    if not item or int(item['ExpiresAt']) <= time.time():
+        return None
+    
+    recipes = json.loads(item['Recipes'])
+    remember_recipes(items_list, recipes)
+    return recipes
+
+def cache_recipes(items_list, recipes):
+    """
+    Store generated recipes in the in-memory cache and the RECIPE_CACHE_TABLE.
+    """
+    remember_recipes(items_list, recipes)
+    
+    if not RECIPE_CACHE_TABLE:
+        return
+    
+    try:
+        RECIPE_CACHE.put_item(Item={
+            'CacheKey': recipe_cache_key(items_list),
+            'Recipes': json_dumps(recipes),
+            'ExpiresAt': int(time.time()) + RECIPE_CACHE_TTL_SECONDS
+        })
+    except ClientError as e:
+        print(f"Error writing recipe cache: {str(e)}")
+
+def remember_recipes(items_list, recipes):
+    """
+    Add recipes to the in-memory cache, evicting the least recently used inventory.
+    """
+    _RECIPE_CACHE[items_list] = recipes
+    _RECIPE_CACHE.move_to_end(items_list)
+    while len(_RECIPE_CACHE) > RECIPE_CACHE_SIZE:
+        _RECIPE_CACHE.popitem(last=False)
+
+def recipe_cache_key(items_list):
+    """
+    Build the recipe cache key for an ingredient list.
+    """
+    return hashlib.blake2b(items_list.encode(), digest_size=16).hexdigest()
+
+def request_recipes(items_list):
+    """
+    Ask DeepSeek for recipes using the given ingredients.
+    """
+    global _endpoint_warm
+    
+    # Prepare the payload for DeepSeek: the prompt is RECIPE_PROMPT_PREFIX
+    # followed by the ingredient list, so only the list needs escaping
+    body = _RECIPE_BODY_PREFIX + json_dumps(items_list)[1:] + _RECIPE_BODY_SUFFIX
+    
+    recipes_text = invoke_endpoint(body)
+    _endpoint_warm = True
+    
+    return parse_recipes_text(recipes_text)
+
+def invoke_endpoint(body):
+    """
+    Invoke the DeepSeek endpoint and return the generated text.
+    """
+    if DEEPSEEK_INFERENCE_MODE == 'async':
+        response_body = invoke_endpoint_async(DEEPSEEK_ENDPOINT, body, DEEPSEEK_ASYNC_INPUT_BUCKET)
+    else:
+        response = sagemaker_runtime.invoke_endpoint(
+            EndpointName=DEEPSEEK_ENDPOINT,
+            ContentType='application/json',
+            Body=body
+        )
+        response_body = response['Body'].read()
+    
+    result = json.loads(response_body)
+    if 'generated_text' not in result:
+        raise Exception("Failed to generate response from DeepSeek endpoint")
+    
+    return result['generated_text']
+
+def parse_recipes_text(recipes_text):
+    """
+    Extract the recipes from the complete DeepSeek response text.
+    """
+    # Extract JSON from the text, decoding from the first opening brace
+    start = recipes_text.find('{')
+    if start >= 0:
+        try:
+            recipes_json, _ = _JSON_DECODER.raw_decode(recipes_text, start)
+            return recipes_json.get('recipes', [])
+        except json.JSONDecodeError:
+            # If JSON parsing fails, try to extract recipes manually
             return parse_recipes_manually(recipes_text)
     else:
-        raise Exception("Failed to generate recipe recommendations")
+        return parse_recipes_manually(recipes_text)
 
 def parse_recipes_manually(recipes_text):
     """
@@ -197,7 +412,7 @@ def parse_recipes_manually(recipes_text):
     recipes = []
     
     # Split by recipe sections (assuming recipes are numbered)
-    recipe_sections = re.split(r'\d+\.', recipes_text)
+    recipe_sections = _SECTION_RE.split(recipes_text)
     
     for section in recipe_sections:
         if not section.strip():
@@ -206,30 +421,30 @@ def parse_recipes_manually(recipes_text):
         recipe = {}
         
         # Try to extract recipe name
-        name_match = re.search(r'(?:Recipe name:|Name:)?\s*([^\n]+)', section)
+        name_match = _NAME_RE.search(section)
         if name_match:
             recipe['name'] = name_match.group(1).strip()
         else:
             continue  # Skip if no name found
         
         # Try to extract ingredients
-        ingredients_match = re.search(r'(?:Ingredients:|Ingredients needed:)([^#]*?)(?:Instructions:|Brief cooking instructions:|$)', section, re.DOTALL)
+        ingredients_match = _INGREDIENTS_RE.search(section)
         if ingredients_match:
             ingredients_text = ingredients_match.group(1).strip()
-            ingredients = [ing.strip() for ing in re.split(r'[\n,]', ingredients_text) if ing.strip()]
+            ingredients = [ing.strip() for ing in _SPLIT_RE.split(ingredients_text) if ing.strip()]
             recipe['ingredients'] = ingredients
         else:
             recipe['ingredients'] = []
         
         # Try to extract instructions
-        instructions_match = re.search(r'(?:Instructions:|Brief cooking instructions:)([^#]*?)(?:Cooking time:|Approximate cooking time:|$)', section, re.DOTALL)
+        instructions_match = _INSTRUCTIONS_RE.search(section)
         if instructions_match:
             recipe['instructions'] = instructions_match.group(1).strip()
         else:
             recipe['instructions'] = "No instructions provided."
         
         # Try to extract cooking time
-        time_match = re.search(r'(?:Cooking time:|Approximate cooking time:)\s*(\d+)', section)
+        time_match = _TIME_RE.search(section)
         if time_match:
             recipe['cooking_time_minutes'] = int(time_match.group(1))
         else:
@@ -242,22 +457,41 @@ def parse_recipes_manually(recipes_text):
 def store_recipes(recipes):
     """
     Store the recommended recipes in DynamoDB.
+    
+    Recipes are sent in batches of 25, so a typical response is written in a
+    single request. Returns the stored recipes.
     """
-    table = dynamodb.Table(RECIPE_TABLE)
+    now = datetime.now()
+    timestamp = now.strftime('%Y%m%d%H%M%S')
+    created_at = now.isoformat()
+    stored_recipes = []
     
-    for recipe in recipes:
-        # Generate a unique ID for the recipe
-        recipe_id = f"recipe-{datetime.now().strftime('%Y%m%d%H%M%S')}-{hash(recipe['name']) % 10000}"
-        
-        # Prepare the recipe for DynamoDB
-        db_recipe = {
-            'RecipeId': recipe_id,
-            'Name': recipe['name'],
-            'Ingredients': recipe['ingredients'],
-            'Instructions': recipe['instructions'],
-            'CookingTimeMinutes': recipe['cooking_time_minutes'],
-            'CreatedAt': datetime.now().isoformat()
-        }
-        
-        # Put the recipe in DynamoDB
-        table.put_item(Item=db_recipe)
+    # batch_writer groups puts into 25-item BatchWriteItem calls and
+    # resends any unprocessed items
+    with RECIPE.batch_writer(overwrite_by_pkeys=['RecipeId']) as batch:
+        for recipe in recipes:
+            # Derive the ID from the recipe name, so a recipe repeated within
+            # the same second overwrites its earlier entry instead of duplicating it
+            recipe_id = f"recipe-{timestamp}-{recipe_id_suffix(recipe['name'])}"
+            
+            # Prepare the recipe for DynamoDB
+            db_recipe = {
+                'RecipeId': recipe_id,
+                'Name': recipe['name'],
+                'Ingredients': recipe['ingredients'],
+                'Instructions': recipe['instructions'],
+                'CookingTimeMinutes': recipe['cooking_time_minutes'],
+                'CreatedAt': created_at
+            }
+            
+            # Queue the recipe for the next batch
+            batch.put_item(Item=db_recipe)
+            stored_recipes.append(recipe)
+    
+    return stored_recipes
+
+def recipe_id_suffix(name):
+    """
+    Build the stable 8 hex digit part of a recipe ID from the recipe name.
+    """
+    return hashlib.blake2b(name.encode(), digest_size=4, person=b'recipe').hexdigest()
@@ -6,12 +6,12 @@
 mkdir -p lambda/dist
 
 # Install required dependencies
-pip install crewai boto3 -t lambda/common/
-pip install crewai boto3 -t lambda/receipt_interpreter/
-pip install crewai boto3 -t lambda/expiration_date_estimator/
-pip install crewai boto3 -t lambda/grocery_tracker/
-pip install crewai boto3 -t lambda/recipe_recommender/
-pip install crewai boto3 -t lambda/orchestrator/
+pip install crewai boto3 orjson -t lambda/common/
+pip install crewai boto3 orjson Pillow -t lambda/receipt_interpreter/
+pip install crewai boto3 orjson -t lambda/expiration_date_estimator/
+pip install crewai boto3 orjson -t lambda/grocery_tracker/
+pip install crewai boto3 orjson -t lambda/recipe_recommender/
+pip install crewai boto3 orjson -t lambda/orchestrator/
 
 # Package receipt_interpreter Lambda
 cd lambda/receipt_interpreter
@@ -47,4 +47,13 @@ zip -r ../dist/recipe_recommender.zip .
 zip -r ../dist/orchestrator.zip .
 cd ../..
 
+# Add the common package, imported as common.*, to each Lambda package
+cd lambda
+zip dist/receipt_interpreter.zip common/*.py
+zip dist/expiration_date_estimator.zip common/*.py
+zip dist/grocery_tracker.zip common/*.py
+zip dist/recipe_recommender.zip common/*.py
+zip dist/orchestrator.zip common/*.py
+cd ..
+
 echo "Lambda packages created successfully in lambda/dist/"
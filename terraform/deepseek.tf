@@ -23,8 +23,28 @@ resource "aws_sagemaker_endpoint_configuration" "deepseek_endpoint_config" {
   production_variants {
     variant_name           = "default"
     model_name             = aws_sagemaker_model.deepseek_model.name
-    instance_type          = var.deepseek_instance_type
-    initial_instance_count = 1
+    instance_type          = var.deepseek_inference_mode == "serverless" ? null : var.deepseek_instance_type
+    initial_instance_count = var.deepseek_inference_mode == "serverless" ? null : 1
+
+    # Serverless Inference: no always-on instance, billed per request
+    dynamic "serverless_config" {
+      for_each = var.deepseek_inference_mode == "serverless" ? [1] : []
+      content {
+        max_concurrency   = var.deepseek_serverless_max_concurrency
+        memory_size_in_mb = var.deepseek_serverless_memory_size
+      }
+    }
+  }
+
+  # Asynchronous Inference: requests are queued by SageMaker and results written to S3
+  dynamic "async_inference_config" {
+    for_each = var.deepseek_inference_mode == "async" ? [1] : []
+    content {
+      output_config {
+        s3_output_path  = "s3://${aws_s3_bucket.receipt_bucket.bucket}/deepseek-async-output/"
+        s3_failure_path = "s3://${aws_s3_bucket.receipt_bucket.bucket}/deepseek-async-failure/"
+      }
+    }
   }
 }
 
@@ -33,6 +53,82 @@ resource "aws_sagemaker_endpoint" "deepseek_endpoint" {
   endpoint_config_name = aws_sagemaker_endpoint_configuration.deepseek_endpoint_config.name
 }
 
+# Let an asynchronous endpoint scale in to zero instances while its queue is empty
+resource "aws_appautoscaling_target" "deepseek_async" {
+  count              = var.deepseek_inference_mode == "async" ? 1 : 0
+  service_namespace  = "sagemaker"
+  resource_id        = "endpoint/${aws_sagemaker_endpoint.deepseek_endpoint.name}/variant/default"
+  scalable_dimension = "sagemaker:variant:DesiredInstanceCount"
+  min_capacity       = 0
+  max_capacity       = var.deepseek_async_max_instances
+}
+
+resource "aws_appautoscaling_policy" "deepseek_async_backlog" {
+  count              = var.deepseek_inference_mode == "async" ? 1 : 0
+  name               = "deepseek-async-backlog"
+  policy_type        = "TargetTrackingScaling"
+  service_namespace  = aws_appautoscaling_target.deepseek_async[0].service_namespace
+  resource_id        = aws_appautoscaling_target.deepseek_async[0].resource_id
+  scalable_dimension = aws_appautoscaling_target.deepseek_async[0].scalable_dimension
+
+  target_tracking_scaling_policy_configuration {
+    target_value = var.deepseek_async_backlog_per_instance
+
+    customized_metric_specification {
+      metric_name = "ApproximateBacklogSizePerInstance"
+      namespace   = "AWS/SageMaker"
+      statistic   = "Average"
+
+      dimensions {
+        name  = "EndpointName"
+        value = aws_sagemaker_endpoint.deepseek_endpoint.name
+      }
+    }
+  }
+}
+
+# Target tracking cannot scale out from zero instances, since the backlog per
+# instance is undefined without instances. Add one as soon as requests are
+# queued while the endpoint has none.
+resource "aws_appautoscaling_policy" "deepseek_async_scale_out_from_zero" {
+  count              = var.deepseek_inference_mode == "async" ? 1 : 0
+  name               = "deepseek-async-scale-out-from-zero"
+  policy_type        = "StepScaling"
+  service_namespace  = aws_appautoscaling_target.deepseek_async[0].service_namespace
+  resource_id        = aws_appautoscaling_target.deepseek_async[0].resource_id
+  scalable_dimension = aws_appautoscaling_target.deepseek_async[0].scalable_dimension
+
+  step_scaling_policy_configuration {
+    adjustment_type         = "ChangeInCapacity"
+    cooldown                = 300
+    metric_aggregation_type = "Average"
+
+    step_adjustment {
+      metric_interval_lower_bound = 0
+      scaling_adjustment          = 1
+    }
+  }
+}
+
+resource "aws_cloudwatch_metric_alarm" "deepseek_async_backlog_without_capacity" {
+  count               = var.deepseek_inference_mode == "async" ? 1 : 0
+  alarm_name          = "deepseek-async-backlog-without-capacity"
+  alarm_description   = "Requests are queued on the asynchronous DeepSeek endpoint while it has no instances"
+  namespace           = "AWS/SageMaker"
+  metric_name         = "HasBacklogWithoutCapacity"
+  statistic           = "Average"
+  period              = 60
+  evaluation_periods  = 1
+  threshold           = 1
+  comparison_operator = "GreaterThanOrEqualToThreshold"
+  treat_missing_data  = "missing"
+  alarm_actions       = [aws_appautoscaling_policy.deepseek_async_scale_out_from_zero[0].arn]
+
+  dimensions = {
+    EndpointName = aws_sagemaker_endpoint.deepseek_endpoint.name
+  }
+}
+
 # IAM role for SageMaker
 resource "aws_iam_role" "sagemaker_role" {
   name = "grocery_management_sagemaker_role"
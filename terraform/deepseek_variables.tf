@@ -15,3 +15,44 @@ variable "deepseek_instance_type" {
   type        = string
   default     = "ml.g5.2xlarge"
 }
+
+variable "deepseek_inference_mode" {
+  description = "How the DeepSeek endpoint is served: realtime, serverless (CPU only, no always-on instance) or async (queued, scales to zero)"
+  type        = string
+  default     = "realtime"
+
+  validation {
+    condition     = contains(["realtime", "serverless", "async"], var.deepseek_inference_mode)
+    error_message = "deepseek_inference_mode must be realtime, serverless or async."
+  }
+}
+
+variable "deepseek_serverless_max_concurrency" {
+  description = "Maximum concurrent invocations of a serverless DeepSeek endpoint"
+  type        = number
+  default     = 50
+}
+
+variable "deepseek_serverless_memory_size" {
+  description = "Memory in MB of a serverless DeepSeek endpoint"
+  type        = number
+  default     = 6144
+}
+
+variable "deepseek_async_max_instances" {
+  description = "Maximum instance count of an asynchronous DeepSeek endpoint"
+  type        = number
+  default     = 2
+}
+
+variable "deepseek_async_backlog_per_instance" {
+  description = "Target number of queued requests per instance of an asynchronous DeepSeek endpoint"
+  type        = number
+  default     = 5
+}
+
+variable "deepseek_async_api_timeout" {
+  description = "Seconds functions behind API Gateway wait for an asynchronous DeepSeek result, within API Gateway's 29 second integration timeout"
+  type        = number
+  default     = 25
+}
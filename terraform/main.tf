@@ -32,6 +32,34 @@ resource "aws_dynamodb_table" "grocery_items" {
     type = "S"
   }
 
+  attribute {
+    name = "ReceiptId"
+    type = "S"
+  }
+
+  attribute {
+    name = "ExpiringBucket"
+    type = "S"
+  }
+
+  attribute {
+    name = "ExpirationDate"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name            = "ReceiptId-index"
+    hash_key        = "ReceiptId"
+    projection_type = "ALL"
+  }
+
+  global_secondary_index {
+    name            = "Expiration-index"
+    hash_key        = "ExpiringBucket"
+    range_key       = "ExpirationDate"
+    projection_type = "ALL"
+  }
+
   tags = {
     Name        = "GroceryItems"
     Environment = var.environment
@@ -54,6 +82,124 @@ resource "aws_dynamodb_table" "recipes" {
   }
 }
 
+resource "aws_dynamodb_table" "llm_cache" {
+  name           = "LLMCache"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "CacheKey"
+  
+  attribute {
+    name = "CacheKey"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "LLMCache"
+    Environment = var.environment
+  }
+}
+
+resource "aws_dynamodb_table" "recipe_cache" {
+  name           = "RecipeCache"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "CacheKey"
+  
+  attribute {
+    name = "CacheKey"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "RecipeCache"
+    Environment = var.environment
+  }
+}
+
+resource "aws_dynamodb_table" "shelf_life_cache" {
+  name           = "ShelfLifeCache"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "NormalizedName"
+  
+  attribute {
+    name = "NormalizedName"
+    type = "S"
+  }
+
+  tags = {
+    Name        = "ShelfLifeCache"
+    Environment = var.environment
+  }
+}
+
+resource "aws_dynamodb_table" "receipt_jobs" {
+  name           = "ReceiptJobs"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "RequestId"
+  
+  attribute {
+    name = "RequestId"
+    type = "S"
+  }
+
+  tags = {
+    Name        = "ReceiptJobs"
+    Environment = var.environment
+  }
+}
+
+resource "aws_dynamodb_table" "processed_receipts" {
+  name           = "ProcessedReceipts"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "ContentHash"
+  
+  attribute {
+    name = "ContentHash"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "ProcessedReceipts"
+    Environment = var.environment
+  }
+}
+
+# SQS queue buffering receipts for the CrewAI worker
+resource "aws_sqs_queue" "receipt_queue" {
+  name                       = "grocery-management-receipts"
+  visibility_timeout_seconds = 6 * var.crewai_worker_timeout
+}
+
+# SQS queue batching receipts for expiration date estimation. Receipts that
+# keep failing are moved to the dead-letter queue.
+resource "aws_sqs_queue" "expiration_queue" {
+  name                       = "grocery-management-expiration-estimates"
+  visibility_timeout_seconds = 6 * var.expiration_batch_timeout
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.expiration_dead_letter_queue.arn
+    maxReceiveCount     = var.expiration_max_receive_count
+  })
+}
+
+resource "aws_sqs_queue" "expiration_dead_letter_queue" {
+  name                      = "grocery-management-expiration-estimates-dlq"
+  message_retention_seconds = 1209600
+}
+
 # IAM role for Lambda functions
 resource "aws_iam_role" "lambda_role" {
   name = "grocery_management_lambda_role"
@@ -93,6 +239,7 @@ resource "aws_iam_policy" "lambda_policy" {
         Action = [
           "s3:GetObject",
           "s3:PutObject",
+          "s3:DeleteObject",
           "s3:ListBucket"
         ]
         Effect   = "Allow"
@@ -108,17 +255,39 @@ resource "aws_iam_policy" "lambda_policy" {
           "dynamodb:UpdateItem",
           "dynamodb:DeleteItem",
           "dynamodb:Query",
-          "dynamodb:Scan"
+          "dynamodb:Scan",
+          "dynamodb:BatchGetItem",
+          "dynamodb:BatchWriteItem"
         ]
         Effect   = "Allow"
         Resource = [
           "${aws_dynamodb_table.grocery_items.arn}",
-          "${aws_dynamodb_table.recipes.arn}"
+          "${aws_dynamodb_table.grocery_items.arn}/index/*",
+          "${aws_dynamodb_table.recipes.arn}",
+          "${aws_dynamodb_table.llm_cache.arn}",
+          "${aws_dynamodb_table.recipe_cache.arn}",
+          "${aws_dynamodb_table.shelf_life_cache.arn}",
+          "${aws_dynamodb_table.receipt_jobs.arn}",
+          "${aws_dynamodb_table.processed_receipts.arn}"
+        ]
+      },
+      {
+        Action = [
+          "sqs:SendMessage",
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ]
+        Effect   = "Allow"
+        Resource = [
+          aws_sqs_queue.receipt_queue.arn,
+          aws_sqs_queue.expiration_queue.arn
         ]
       },
       {
         Action = [
-          "sagemaker:InvokeEndpoint"
+          "sagemaker:InvokeEndpoint",
+          "sagemaker:InvokeEndpointAsync"
         ]
         Effect   = "Allow"
         Resource = "*"
@@ -149,6 +318,10 @@ resource "aws_lambda_function" "receipt_interpreter" {
       RECEIPT_BUCKET = aws_s3_bucket.receipt_bucket.bucket
       GROCERY_TABLE  = aws_dynamodb_table.grocery_items.name
       DEEPSEEK_ENDPOINT = var.deepseek_endpoint_name
+      PROCESSED_RECEIPTS_TABLE = aws_dynamodb_table.processed_receipts.name
+      DEEPSEEK_INFERENCE_MODE = var.deepseek_inference_mode
+      DEEPSEEK_ASYNC_INPUT_BUCKET = aws_s3_bucket.receipt_bucket.bucket
+      DEEPSEEK_ASYNC_TIMEOUT = var.deepseek_async_api_timeout
     }
   }
 }
@@ -167,10 +340,45 @@ resource "aws_lambda_function" "expiration_date_estimator" {
     variables = {
       GROCERY_TABLE  = aws_dynamodb_table.grocery_items.name
       DEEPSEEK_ENDPOINT = var.deepseek_endpoint_name
+      SHELF_LIFE_CACHE_TABLE = aws_dynamodb_table.shelf_life_cache.name
+      DEEPSEEK_INFERENCE_MODE = var.deepseek_inference_mode
+      DEEPSEEK_ASYNC_INPUT_BUCKET = aws_s3_bucket.receipt_bucket.bucket
+      DEEPSEEK_ASYNC_TIMEOUT = var.deepseek_async_api_timeout
     }
   }
 }
 
+# Estimates expiration dates for batches of queued receipts with one DeepSeek call
+resource "aws_lambda_function" "expiration_date_batcher" {
+  function_name    = "expiration_date_batcher"
+  filename         = var.expiration_date_estimator_zip
+  source_code_hash = filebase64sha256(var.expiration_date_estimator_zip)
+  role             = aws_iam_role.lambda_role.arn
+  handler          = "app.batch_handler"
+  runtime          = "python3.9"
+  timeout          = var.expiration_batch_timeout
+  memory_size      = 256
+
+  environment {
+    variables = {
+      GROCERY_TABLE  = aws_dynamodb_table.grocery_items.name
+      DEEPSEEK_ENDPOINT = var.deepseek_endpoint_name
+      SHELF_LIFE_CACHE_TABLE = aws_dynamodb_table.shelf_life_cache.name
+      DEEPSEEK_INFERENCE_MODE = var.deepseek_inference_mode
+      DEEPSEEK_ASYNC_INPUT_BUCKET = aws_s3_bucket.receipt_bucket.bucket
+      DEEPSEEK_ASYNC_TIMEOUT = var.expiration_batch_timeout - 20
+    }
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "expiration_date_batcher_queue" {
+  event_source_arn                   = aws_sqs_queue.expiration_queue.arn
+  function_name                      = aws_lambda_function.expiration_date_batcher.arn
+  batch_size                         = var.expiration_batch_size
+  maximum_batching_window_in_seconds = var.expiration_batch_window
+  function_response_types            = ["ReportBatchItemFailures"]
+}
+
 resource "aws_lambda_function" "grocery_tracker" {
   function_name    = "grocery_tracker"
   filename         = var.grocery_tracker_zip
@@ -203,6 +411,10 @@ resource "aws_lambda_function" "recipe_recommender" {
       GROCERY_TABLE  = aws_dynamodb_table.grocery_items.name
       RECIPE_TABLE   = aws_dynamodb_table.recipes.name
       DEEPSEEK_ENDPOINT = var.deepseek_endpoint_name
+      RECIPE_CACHE_TABLE = aws_dynamodb_table.recipe_cache.name
+      DEEPSEEK_INFERENCE_MODE = var.deepseek_inference_mode
+      DEEPSEEK_ASYNC_INPUT_BUCKET = aws_s3_bucket.receipt_bucket.bucket
+      DEEPSEEK_ASYNC_TIMEOUT = var.deepseek_async_api_timeout
     }
   }
 }
@@ -223,15 +435,74 @@ resource "aws_lambda_function" "orchestrator" {
       EXPIRATION_DATE_ESTIMATOR_FUNCTION = aws_lambda_function.expiration_date_estimator.function_name
       GROCERY_TRACKER_FUNCTION = aws_lambda_function.grocery_tracker.function_name
       RECIPE_RECOMMENDER_FUNCTION = aws_lambda_function.recipe_recommender.function_name
+      EXPIRATION_QUEUE_URL = aws_sqs_queue.expiration_queue.url
       DEEPSEEK_ENDPOINT = var.deepseek_endpoint_name
     }
   }
 }
 
+# Accepts CrewAI receipt uploads, queues them for the worker and reports their status
+resource "aws_lambda_function" "crewai_receiver" {
+  function_name    = "grocery_management_crewai_receiver"
+  filename         = var.orchestrator_zip
+  source_code_hash = filebase64sha256(var.orchestrator_zip)
+  role             = aws_iam_role.lambda_role.arn
+  handler          = "crewai_handler.lambda_handler"
+  runtime          = "python3.9"
+  timeout          = 30
+  memory_size      = 256
+
+  environment {
+    variables = {
+      RECEIPT_BUCKET = aws_s3_bucket.receipt_bucket.bucket
+      RECEIPT_QUEUE_URL = aws_sqs_queue.receipt_queue.url
+      RECEIPT_JOBS_TABLE = aws_dynamodb_table.receipt_jobs.name
+    }
+  }
+}
+
+# CrewAI worker consuming queued receipts. Its reserved concurrency caps the
+# number of workflows hitting the DeepSeek endpoint at once.
+resource "aws_lambda_function" "crewai_worker" {
+  function_name    = "grocery_management_crewai_worker"
+  filename         = var.orchestrator_zip
+  source_code_hash = filebase64sha256(var.orchestrator_zip)
+  role             = aws_iam_role.lambda_role.arn
+  handler          = "crewai_handler.worker_handler"
+  runtime          = "python3.9"
+  timeout          = var.crewai_worker_timeout
+  memory_size      = 1024
+
+  reserved_concurrent_executions = var.crewai_worker_concurrency
+
+  environment {
+    variables = {
+      RECEIPT_BUCKET = aws_s3_bucket.receipt_bucket.bucket
+      RECEIPT_QUEUE_URL = aws_sqs_queue.receipt_queue.url
+      RECEIPT_JOBS_TABLE = aws_dynamodb_table.receipt_jobs.name
+      DEEPSEEK_ENDPOINT = var.deepseek_endpoint_name
+      LLM_CACHE_TABLE = aws_dynamodb_table.llm_cache.name
+      SHELF_LIFE_CACHE_TABLE = aws_dynamodb_table.shelf_life_cache.name
+      DEEPSEEK_INFERENCE_MODE = var.deepseek_inference_mode
+      DEEPSEEK_ASYNC_INPUT_BUCKET = aws_s3_bucket.receipt_bucket.bucket
+      DEEPSEEK_ASYNC_TIMEOUT = var.crewai_worker_timeout - 20
+    }
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "crewai_worker_queue" {
+  event_source_arn = aws_sqs_queue.receipt_queue.arn
+  function_name    = aws_lambda_function.crewai_worker.arn
+  batch_size       = 1
+}
+
 # API Gateway
 resource "aws_api_gateway_rest_api" "grocery_api" {
   name        = "GroceryManagementAPI"
   description = "API for Grocery Management System"
+  
+  # Gzip responses of 1 KB or more for clients that send Accept-Encoding: gzip
+  minimum_compression_size = 1024
 }
 
 # API Gateway resources
@@ -241,6 +512,24 @@ resource "aws_api_gateway_resource" "receipts" {
   path_part   = "receipts"
 }
 
+resource "aws_api_gateway_resource" "crew" {
+  rest_api_id = aws_api_gateway_rest_api.grocery_api.id
+  parent_id   = aws_api_gateway_rest_api.grocery_api.root_resource_id
+  path_part   = "crew"
+}
+
+resource "aws_api_gateway_resource" "crew_receipts" {
+  rest_api_id = aws_api_gateway_rest_api.grocery_api.id
+  parent_id   = aws_api_gateway_resource.crew.id
+  path_part   = "receipts"
+}
+
+resource "aws_api_gateway_resource" "crew_receipt" {
+  rest_api_id = aws_api_gateway_rest_api.grocery_api.id
+  parent_id   = aws_api_gateway_resource.crew_receipts.id
+  path_part   = "{request_id}"
+}
+
 resource "aws_api_gateway_resource" "grocery" {
   rest_api_id = aws_api_gateway_rest_api.grocery_api.id
   parent_id   = aws_api_gateway_rest_api.grocery_api.root_resource_id
@@ -271,6 +560,41 @@ resource "aws_api_gateway_integration" "post_receipt_integration" {
   uri                     = aws_lambda_function.orchestrator.invoke_arn
 }
 
+# API Gateway methods for CrewAI receipts
+resource "aws_api_gateway_method" "post_crew_receipt" {
+  rest_api_id   = aws_api_gateway_rest_api.grocery_api.id
+  resource_id   = aws_api_gateway_resource.crew_receipts.id
+  http_method   = "POST"
+  authorization_type = "NONE"
+}
+
+resource "aws_api_gateway_integration" "post_crew_receipt_integration" {
+  rest_api_id = aws_api_gateway_rest_api.grocery_api.id
+  resource_id = aws_api_gateway_resource.crew_receipts.id
+  http_method = aws_api_gateway_method.post_crew_receipt.http_method
+  
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.crewai_receiver.invoke_arn
+}
+
+resource "aws_api_gateway_method" "get_crew_receipt" {
+  rest_api_id   = aws_api_gateway_rest_api.grocery_api.id
+  resource_id   = aws_api_gateway_resource.crew_receipt.id
+  http_method   = "GET"
+  authorization_type = "NONE"
+}
+
+resource "aws_api_gateway_integration" "get_crew_receipt_integration" {
+  rest_api_id = aws_api_gateway_rest_api.grocery_api.id
+  resource_id = aws_api_gateway_resource.crew_receipt.id
+  http_method = aws_api_gateway_method.get_crew_receipt.http_method
+  
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.crewai_receiver.invoke_arn
+}
+
 # API Gateway methods for grocery
 resource "aws_api_gateway_method" "get_grocery" {
   rest_api_id   = aws_api_gateway_rest_api.grocery_api.id
@@ -311,6 +635,8 @@ resource "aws_api_gateway_integration" "get_recipes_integration" {
 resource "aws_api_gateway_deployment" "grocery_api_deployment" {
   depends_on = [
     aws_api_gateway_integration.post_receipt_integration,
+    aws_api_gateway_integration.post_crew_receipt_integration,
+    aws_api_gateway_integration.get_crew_receipt_integration,
     aws_api_gateway_integration.get_grocery_integration,
     aws_api_gateway_integration.get_recipes_integration
   ]
@@ -328,6 +654,14 @@ resource "aws_lambda_permission" "orchestrator_api_permission" {
   source_arn    = "${aws_api_gateway_rest_api.grocery_api.execution_arn}/*/*"
 }
 
+resource "aws_lambda_permission" "crewai_receiver_api_permission" {
+  statement_id  = "AllowAPIGatewayInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.crewai_receiver.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "${aws_api_gateway_rest_api.grocery_api.execution_arn}/*/*"
+}
+
 resource "aws_lambda_permission" "grocery_tracker_api_permission" {
   statement_id  = "AllowAPIGatewayInvoke"
   action        = "lambda:InvokeFunction"
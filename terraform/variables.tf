@@ -51,3 +51,39 @@ variable "deepseek_endpoint_name" {
   type        = string
   default     = "deepseek-r1-endpoint"
 }
+
+variable "crewai_worker_concurrency" {
+  description = "Reserved concurrency of the CrewAI worker (about 2x the DeepSeek endpoint instance count)"
+  type        = number
+  default     = 2
+}
+
+variable "crewai_worker_timeout" {
+  description = "Timeout in seconds of the CrewAI worker Lambda function"
+  type        = number
+  default     = 300
+}
+
+variable "expiration_batch_size" {
+  description = "Maximum number of queued receipts whose expiration dates are estimated with one DeepSeek call"
+  type        = number
+  default     = 10
+}
+
+variable "expiration_batch_window" {
+  description = "Seconds to wait for queued receipts to fill an expiration estimate batch"
+  type        = number
+  default     = 1
+}
+
+variable "expiration_batch_timeout" {
+  description = "Timeout in seconds of the expiration date batcher Lambda function"
+  type        = number
+  default     = 120
+}
+
+variable "expiration_max_receive_count" {
+  description = "Number of times a queued receipt is retried before it moves to the expiration dead-letter queue"
+  type        = number
+  default     = 3
+}